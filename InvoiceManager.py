@@ -1,459 +1,3770 @@
-import os
-from datetime import datetime, timedelta
-import openpyxl
-import pandas as pd
-import tkinter as tk
-from tkinter import ttk, messagebox
-from tkinter import Canvas
-from openpyxl import load_workbook
-import pdfkit
-
-
-class InvoiceManager:
-    def __init__(self, template_path, booking_file):
-        self.template_path = template_path
-        self.booking_file = booking_file
-        
-        if not os.path.exists(template_path):
-            raise FileNotFoundError(f"Template file {template_path} not found.")
-        
-        self.wb_template = openpyxl.load_workbook(template_path, keep_links=False)
-        self.template_sheet = self.wb_template.active
-        
-        if not os.path.exists(booking_file):
-            self.df_booking = pd.DataFrame(columns=['Invoice Number', 'Name', 'Amount', 'Date', 'Due Date', 'File Path',
-                                                    'Address', 'City', 'Postal Code', 'Country', 'Phone Number',
-                                                    'Hourly Rate', 'Hours Booked', 'Status'])
-            self.df_booking.to_csv(booking_file, index=False)
-        else:
-            self.df_booking = pd.read_csv(booking_file)
-            
-            if 'Invoice Number' not in self.df_booking.columns or self.df_booking['Invoice Number'].empty:
-                self.df_booking = pd.DataFrame(columns=['Invoice Number', 'Name', 'Amount', 'Date', 'Due Date', 'File Path',
-                                                        'Address', 'City', 'Postal Code', 'Country', 'Phone Number',
-                                                        'Hourly Rate', 'Hours Booked', 'Status'])
-                self.df_booking.to_csv(booking_file, index=False)
-
-        if self.df_booking['Invoice Number'].empty or self.df_booking['Invoice Number'].isna().all():
-            self.next_invoice_number = 1
-        else:
-            self.next_invoice_number = self.df_booking['Invoice Number'].apply(lambda x: int(x[1:]) if x.startswith('s') else 0).max() + 1
-
-    
-
-    def create_invoice(self, name, amount, date, due_date=None, hours=None, hourly_rate=None, total=None,
-                       address=None, city=None, postal_code=None, country=None, phone_number=None, description=None):
-        try:
-            # Ensure date is datetime object
-            if not isinstance(date, datetime):
-                date = datetime.strptime(date, "%Y-%m-%d")
-
-            # Calculate due date if not provided
-            if due_date is None:
-                due_date = date + timedelta(days=14)
-
-            # Generate invoice number and format as string
-            invoice_number = max(1, self.next_invoice_number)
-            invoice_number_str = f's{invoice_number}'
-            print(f"Generated invoice number: {invoice_number_str} and type {type(invoice_number_str)}")
-
-            # Update self.next_invoice_number for next invoice
-            self.next_invoice_number += 1
-
-            # Calculate amount based on provided data
-            if hours is not None and hourly_rate is not None:
-                amount = hours * hourly_rate
-                amount = int(amount)
-            elif total is not None:
-                amount = total
-                amount = int(amount)
-
-            print(f"Calculated amount: {amount}")
-
-            # Load the template
-            print("Loading template...")
-            wb_template = load_workbook(self.template_path)
-            invoice_sheet = wb_template.active
-
-            # Calculate due date for invoice
-            due_date = date + timedelta(days=14)
-
-            # Debugging information before setting cell values
-            print("Setting invoice sheet values...")
-            
-            # Set values in specific cells
-            invoice_sheet['B22'].value = description
-            invoice_sheet['F12'].value = invoice_number_str
-            invoice_sheet['C22'].value = date.strftime("%Y-%m-%d")
-            invoice_sheet['B9'].value = date.strftime("%Y-%m-%d")
-            invoice_sheet['D22'].value = str(date.isocalendar()[1])
-            invoice_sheet['E22'].value = hours if hours is not None else ''
-            invoice_sheet['F22'].value = f'€ {hourly_rate:,.2f}' if hourly_rate is not None else ''
-            invoice_sheet['B12'].value = name
-            invoice_sheet['B13'].value = address if address else ''
-            invoice_sheet['B14'].value = city if city else ''
-            invoice_sheet['B15'].value = f'{postal_code}, {country}' if postal_code and country else ''
-            invoice_sheet['B16'].value = phone_number if phone_number else ''
-            invoice_sheet['F17'].value = due_date.strftime("%Y-%m-%d")
-
-           # Save the invoice to a file
-            invoice_filename = f'invoice_{invoice_number_str}_{name}.xlsx'
-            full_invoice_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), invoice_filename)
-            print(f"Saving invoice to {full_invoice_path}...")
-
-            try:
-                wb_template.save(full_invoice_path)
-                print("Invoice saved successfully.")
-            except PermissionError as pe:
-                print(f"Permission error: Unable to save the file. Please check if you have write access to {full_invoice_path}")
-                raise pe
-            except Exception as save_error:
-                print(f"Error saving the file: {save_error}")
-                raise save_error
-            finally:
-                wb_template.close()  # Ensure workbook is closed after saving
-            """
-            # Save as PDF in the same folder
-            pdf_filename = f'invoice_{invoice_number_str}_{name}.pdf'
-            full_pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), pdf_filename)
-
-             # Read Excel file into pandas DataFrame
-            df = pd.read_excel(full_invoice_path)
-
-            # Convert DataFrame to HTML
-            html_filename = "temp.html"
-            df.to_html(html_filename, index=False)  # Set index=False to exclude row numbers
-
-            # Convert HTML to PDF using pdfkit
-            pdfkit.from_file(html_filename, full_pdf_path)
-
-            # Remove temporary HTML file
-            os.remove(html_filename)
-
-            print(f"Invoice PDF saved successfully to {full_pdf_path}")
-            """
-            # Update data frame with new invoice information
-            new_invoice = pd.DataFrame([{
-                'Invoice Number': invoice_number_str,
-                'Name': name,
-                'Description': description,
-                'Amount': amount,
-                'Date': date.strftime("%Y-%m-%d"),
-                'Due Date': due_date.strftime("%Y-%m-%d"),
-                'File Path': full_invoice_path,
-                'Address': address,
-                'City': city,
-                'Postal Code': postal_code,
-                'Country': country,
-                'Phone Number': phone_number,
-                'Hourly Rate': hourly_rate if hourly_rate is not None else 0,
-                'Hours Booked': hours if hours is not None else 0,
-                'Status': 'Outstanding'
-            }])
-            self.df_booking = pd.concat([self.df_booking, new_invoice], ignore_index=True)
-
-            # Save updated data frame to CSV file
-            print(f"Saving booking data to {self.booking_file}...")
-            self.df_booking.to_csv(self.booking_file, index=False)
-            print("Booking data saved successfully.")
-
-            return full_invoice_path
-
-        except Exception as e:
-            print(f"Error occurred while creating invoice: {e}")
-            raise e
-
-
-    def send_reminders(self):
-        today = datetime.today()
-        due_in_7_days = today + timedelta(days=7)
-        overdue = self.df_booking[pd.to_datetime(self.df_booking['Due Date']) < today]
-        due_soon = self.df_booking[pd.to_datetime(self.df_booking['Due Date']) == due_in_7_days]
-
-        reminders = []
-        for _, row in overdue.iterrows():
-            reminders.append(f"Reminder: Invoice {row['Invoice Number']} is overdue! Please contact {row['Name']}.")
-
-        for _, row in due_soon.iterrows():
-            reminders.append(f"Reminder: Invoice {row['Invoice Number']} is due in 7 days. Please contact {row['Name']}.")
-
-        return reminders
-
-    def get_invoices(self):
-        return self.df_booking[['Invoice Number', 'Name', 'Amount', 'Date', 'Due Date', 'Status']]
-
-    def set_cell_value(self, sheet, cell, value):
-        try:
-            print(f"Setting cell {cell} with cell type {type(cell)} with value: {value}")
-
-            if isinstance(cell, str):
-                cell = sheet[cell]
-                print(f"Cell coordinates resolved: {cell.coordinate}")
-
-            merged_range = None
-            for range_coord in sheet.merged_cells.ranges:
-                if cell.coordinate in range_coord:
-                    merged_range = range_coord
-                    print(f"Found merged range: {merged_range}")
-                    break
-
-            if merged_range:
-                print(f"Unmerging cells in range: {merged_range}")
-                sheet.unmerge_cells(merged_range)
-                sheet[cell.coordinate] = value  # Set value directly without merging
-                print(f"Set cell {cell} with value {value}")
-            else:
-                if isinstance(value, (int, float)):
-                    print(f"Setting numeric value: {value}")
-                    cell.value = value  # Set numeric value directly
-                else:
-                    print(f"Setting string value: {value}")
-                    cell.value = str(value)  # Convert non-numeric values to string
-
-        except Exception as e:
-            print(f"Error occurred while setting cell {cell} with value {value}: {e}")
-            # Optionally, raise the error again to propagate it up or handle it as needed
-            raise e
-
-
-    def get_total_received(self):
-        return self.df_booking[self.df_booking['Status'] == 'Paid']['Amount'].sum()
-
-    def get_total_outstanding(self):
-        return self.df_booking[self.df_booking['Status'] == 'Outstanding']['Amount'].sum()
-
-    def update_invoice_status(self, invoice_number, status):
-        self.df_booking.loc[self.df_booking['Invoice Number'] == invoice_number, 'Status'] = status
-        self.df_booking.to_csv(self.booking_file, index=False)
-
-    def search_invoices(self, query):
-        return self.df_booking[self.df_booking['Name'].str.contains(query, case=False, na=False)]
-
-    def get_invoice_details(self, invoice_number):
-        invoice_details = self.df_booking[self.df_booking['Invoice Number'] == invoice_number].to_string(index=False)
-        return invoice_details
-
-class InvoiceApp:
-    def __init__(self, root, manager):
-        self.manager = manager
-        self.root = root
-        self.root.title("Invoice Manager")
-        self.root.geometry("1600x1000")
-
-        self.create_widgets()
-
-    def create_widgets(self):
-        main_frame = ttk.Frame(self.root, padding="10")
-        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-
-        ttk.Label(main_frame, text="Name Recipient:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
-        self.name_entry = ttk.Entry(main_frame)
-        self.name_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Address:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
-        self.address_entry = ttk.Entry(main_frame)
-        self.address_entry.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="City:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
-        self.city_entry = ttk.Entry(main_frame)
-        self.city_entry.grid(row=2, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Postal Code:").grid(row=3, column=0, sticky=tk.W, padx=5, pady=5)
-        self.postal_code_entry = ttk.Entry(main_frame)
-        self.postal_code_entry.grid(row=3, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Country:").grid(row=4, column=0, sticky=tk.W, padx=5, pady=5)
-        self.country_entry = ttk.Entry(main_frame)
-        self.country_entry.grid(row=4, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Phone Number:").grid(row=5, column=0, sticky=tk.W, padx=5, pady=5)
-        self.phone_number_entry = ttk.Entry(main_frame)
-        self.phone_number_entry.grid(row=5, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Amount:").grid(row=6, column=0, sticky=tk.W, padx=5, pady=5)
-        self.amount_entry = ttk.Entry(main_frame)
-        self.amount_entry.grid(row=6, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Hourly Rate:").grid(row=7, column=0, sticky=tk.W, padx=5, pady=5)
-        self.hourly_rate_entry = ttk.Entry(main_frame)
-        self.hourly_rate_entry.grid(row=7, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Hours Booked:").grid(row=8, column=0, sticky=tk.W, padx=5, pady=5)
-        self.hours_entry = ttk.Entry(main_frame)
-        self.hours_entry.grid(row=8, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Date (YYYY-MM-DD):").grid(row=9, column=0, sticky=tk.W, padx=5, pady=5)
-        self.date_entry = ttk.Entry(main_frame)
-        self.date_entry.grid(row=9, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Description:").grid(row=10, column=0, sticky=tk.W, padx=5, pady=5)
-        self.description_entry = ttk.Entry(main_frame)
-        self.description_entry.grid(row=10, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-
-        ttk.Button(main_frame, text="Create Invoice", command=self.create_invoice).grid(row=11, column=0, columnspan=2, padx=5, pady=5)
-
-        self.invoice_list = ttk.Treeview(main_frame, columns=('Invoice Number', 'Name', 'Amount', 'Date', 'Due Date', 'Status'), show='headings')
-        self.invoice_list.heading('Invoice Number', text='Invoice Number')
-        self.invoice_list.heading('Name', text='Name')
-        self.invoice_list.heading('Amount', text='Amount')
-        self.invoice_list.heading('Date', text='Date')
-        self.invoice_list.heading('Due Date', text='Due Date')
-        self.invoice_list.heading('Status', text='Status')
-
-        self.invoice_list.grid(row=12, column=0, columnspan=2, padx=5, pady=5, sticky=(tk.W, tk.E))
-
-        self.update_invoice_list()
-
-        ttk.Button(main_frame, text="Mark as Paid", command=self.mark_as_paid).grid(row=13, column=0, columnspan=2, padx=5, pady=5)
-
-        ttk.Label(main_frame, text="Search:").grid(row=14, column=0, sticky=tk.W, padx=5, pady=5)
-        self.search_entry = ttk.Entry(main_frame)
-        self.search_entry.grid(row=14, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
-        ttk.Button(main_frame, text="Search", command=self.search_invoices).grid(row=14, column=2, padx=5, pady=5)
-
-        self.detail_frame = ttk.Frame(main_frame, padding="10")
-        self.detail_frame.grid(row=15, column=0, columnspan=2, padx=5, pady=5, sticky=(tk.W, tk.E))
-
-        ttk.Label(self.detail_frame, text="Invoice Details", font=("Arial", 12, "bold")).grid(row=0, column=0, columnspan=2, pady=5)
-        self.invoice_detail_text = tk.Text(self.detail_frame, height=10, width=60)
-        self.invoice_detail_text.grid(row=1, column=0, columnspan=2, padx=5, pady=5)
-
-        self.invoice_list.bind("<Double-1>", self.show_invoice_details)
-
-        self.update_invoice_list()
-        self.update_visualization()
-
-    def create_invoice(self):
-        name = self.name_entry.get()
-        address = self.address_entry.get()
-        city = self.city_entry.get()
-        postal_code = self.postal_code_entry.get()
-        country = self.country_entry.get()
-        phone_number = self.phone_number_entry.get()
-        amount = float(self.amount_entry.get()) if self.amount_entry.get() else None
-        hourly_rate = float(self.hourly_rate_entry.get()) if self.hourly_rate_entry.get() else None
-        hours = float(self.hours_entry.get()) if self.hours_entry.get() else None
-        date_str = self.date_entry.get()
-        description = self.description_entry.get()
-
-        if not date_str:
-            messagebox.showerror("Error", "Date field cannot be empty.")
-            return
-
-        try:
-            date = datetime.strptime(date_str, "%Y-%m-%d")
-        except ValueError:
-            messagebox.showerror("Error", "Date format is incorrect. Please use YYYY-MM-DD.")
-            return
-
-        due_date = date + timedelta(days=14)  # Due date is 14 days from the invoice date
-
-        try:
-            invoice_path = self.manager.create_invoice(name, amount, date, due_date, hours, hourly_rate, amount, address, city, postal_code, country, phone_number, description)
-            messagebox.showinfo("Invoice Created", f"Invoice successfully created at: {invoice_path}")
-            self.update_invoice_list()
-            self.clear_entries()
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to create invoice: {e}")
-
-    def clear_entries(self):
-        self.name_entry.delete(0, tk.END)
-        self.address_entry.delete(0, tk.END)
-        self.city_entry.delete(0, tk.END)
-        self.postal_code_entry.delete(0, tk.END)
-        self.country_entry.delete(0, tk.END)
-        self.phone_number_entry.delete(0, tk.END)
-        self.amount_entry.delete(0, tk.END)
-        self.hourly_rate_entry.delete(0, tk.END)
-        self.hours_entry.delete(0, tk.END)
-        self.date_entry.delete(0, tk.END)
-        self.description_entry.delete(0, tk.END)
-
-    def mark_as_paid(self):
-        selected_item = self.invoice_list.selection()
-        if not selected_item:
-            return
-        invoice_number = self.invoice_list.item(selected_item)['values'][0]
-        self.manager.update_invoice_status(invoice_number, 'Paid')
-        self.update_invoice_list()
-
-    def update_invoice_list(self):
-        for i in self.invoice_list.get_children():
-            self.invoice_list.delete(i)
-
-        invoices = self.manager.get_invoices()
-        for _, row in invoices.iterrows():
-            self.invoice_list.insert('', 'end', values=(row['Invoice Number'], row['Name'], row['Amount'], row['Date'],
-                                                        row['Due Date'], row['Status']))
-
-    def search_invoices(self):
-        query = self.search_entry.get().strip()
-        if not query:
-            self.update_invoice_list()  # Reset to show all invoices if search query is empty
-            return
-
-        try:
-            filtered_invoices = self.manager.search_invoices(query)
-            self.invoice_list.delete(*self.invoice_list.get_children())
-
-            for index, row in filtered_invoices.iterrows():
-                self.invoice_list.insert('', 'end', values=(row['Invoice Number'], row['Name'], row['Amount'],
-                                                            row['Date'], row['Due Date'], row['Status']))
-        except Exception as e:
-            messagebox.showerror("Search Error", f"Error occurred during search: {e}")
-
-
-
-    def show_invoice_details(self, event):
-        # Get the selected item in the invoice list
-        selected_item = self.invoice_list.selection()
-        
-        # Check if an item is selected
-        if not selected_item:
-            return
-        
-        try:
-            # Retrieve the invoice number from the selected item
-            invoice_number = self.invoice_list.item(selected_item)['values'][0]
-            
-            # Fetch detailed information about the invoice using the invoice number
-            invoice_details = self.manager.get_invoice_details(invoice_number)
-            
-            # Clear the current text in the invoice_detail_text widget
-            self.invoice_detail_text.delete('1.0', tk.END)
-            
-            # Insert the fetched invoice details into the text widget
-            self.invoice_detail_text.insert(tk.END, invoice_details)
-        
-        except Exception as e:
-            # Display an error message if fetching details fails
-            messagebox.showerror("Error", f"Failed to fetch invoice details: {e}")
-
-
-
-    def update_visualization(self):
-        # Create a canvas widget with specified dimensions
-        canvas = Canvas(self.root, width=1200, height=400)
-        canvas.grid(row=1, column=0)
-        
-        # Retrieve total received and total outstanding amounts from the manager
-        total_received = self.manager.get_total_received()
-        total_outstanding = self.manager.get_total_outstanding()
-        
-        # Display text on the canvas showing total received and total outstanding amounts
-        canvas.create_text(100, 100, text=f"Total Received: € {total_received:,.2f}", font=("Arial", 14))
-        canvas.create_text(100, 150, text=f"Total Outstanding: € {total_outstanding:,.2f}", font=("Arial", 14))
-
-
-
-def main():
-    root = tk.Tk()
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    template_path = os.path.join(current_dir, 'template.xlsx')
-    booking_file = os.path.join(current_dir, 'invoice_booking.csv')
-    manager = InvoiceManager(template_path, booking_file)
-    app = InvoiceApp(root, manager)
-    root.mainloop()
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import os
+import io
+import re
+import sys
+import json
+import time
+import logging
+import contextlib
+import shutil
+import sqlite3
+import argparse
+import importlib
+import multiprocessing
+import queue
+import bisect
+import threading
+import unicodedata
+from array import array
+from collections import defaultdict, deque
+import math
+import numbers
+import zlib
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+class _LazyModule:
+    # Stand-in for a heavy module that is imported the first time one of its attributes is
+    # used, so a script that creates an invoice doesn't pay for importing pandas or tkinter.
+    # After the import the module's attributes are copied over and looked up directly.
+    def __init__(self, name):
+        self._module_name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._module_name)
+        self.__dict__.update(vars(module))
+        return getattr(module, attr)
+
+
+np = _LazyModule('numpy')
+pd = _LazyModule('pandas')
+openpyxl = _LazyModule('openpyxl')
+tk = _LazyModule('tkinter')
+ttk = _LazyModule('tkinter.ttk')
+messagebox = _LazyModule('tkinter.messagebox')
+asyncio = _LazyModule('asyncio')
+cProfile = _LazyModule('cProfile')
+pstats = _LazyModule('pstats')
+
+logger = logging.getLogger('InvoiceManager')
+
+
+BOOKING_COLUMNS = ['Invoice Number', 'Name', 'Amount', 'Date', 'Due Date', 'File Path',
+                   'Address', 'City', 'Postal Code', 'Country', 'Phone Number',
+                   'Hourly Rate', 'Hours Booked', 'Status']
+
+# The in-memory ledger declares 'Description' too. LEDGER_TYPES says how each column is kept
+# in memory (see typed_ledger); columns that aren't listed stay text.
+LEDGER_COLUMNS = BOOKING_COLUMNS + ['Description']
+# Only columns with few distinct values are categoricals; names, addresses and descriptions
+# are close to unique per invoice, where codes plus categories cost more than plain text.
+LEDGER_TYPES = {
+    'Invoice Number': 'invoice_number', 'Amount': 'number', 'Date': 'date', 'Due Date': 'date', 'City': 'category',
+    'Country': 'category', 'Hourly Rate': 'number', 'Hours Booked': 'number', 'Status': 'category',
+}
+
+# Aging buckets for outstanding invoices: label, minimum and maximum number of days overdue.
+# An invoice due today isn't overdue yet, the same as for get_overdue_invoices and reminders.
+AGING_BUCKETS = [('1-30', 1, 30), ('31-60', 31, 60), ('61-90', 61, 90), ('90+', 91, None)]
+
+
+class _Stage:
+    # Times one stage of Metrics.stage
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+_NO_STAGE = _NoStage()
+
+
+class Metrics:
+    # Where the time goes when invoices are created: the duration of every stage (template
+    # load, cell fill, workbook save, ledger append, ledger persist, ...) and counters of
+    # what happened. Each stage keeps its count, its total time and its last `window`
+    # durations, from which snapshot() reports p50/p95/p99 latencies. Durations are also
+    # logged at DEBUG level.
+    #
+    # The module-level `metrics` instance is used throughout. After metrics.disable() a stage
+    # costs one attribute lookup and a shared no-op context manager.
+    def __init__(self, enabled=True, window=10000):
+        self.enabled = enabled
+        self.window = window
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+
+    def stage(self, name):
+        # with metrics.stage('workbook_save'): ...
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, duration):
+        if not self.enabled:
+            return
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = [0, 0.0, deque(maxlen=self.window)]
+            stage[0] += 1
+            stage[1] += duration
+            stage[2].append(duration)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s took %.3f ms", name, duration * 1000)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + amount
+
+    @staticmethod
+    def _percentile(durations, percent):
+        # Nearest-rank percentile of a sorted list
+        return durations[max(0, math.ceil(percent / 100 * len(durations)) - 1)]
+
+    def snapshot(self):
+        # {'stages': {name: {'count', 'total', 'mean', 'p50', 'p95', 'p99', 'max'}}, 'counters': {name: value}},
+        # times in seconds; the percentiles cover the last `window` durations of each stage
+        with self._lock:
+            stages = [(name, count, total, sorted(durations)) for name, (count, total, durations) in self._stages.items()]
+            counters = dict(self._counters)
+        return {
+            'stages': {name: {'count': count, 'total': total, 'mean': total / count,
+                              'p50': self._percentile(durations, 50), 'p95': self._percentile(durations, 95),
+                              'p99': self._percentile(durations, 99), 'max': durations[-1]}
+                       for name, count, total, durations in stages},
+            'counters': counters,
+        }
+
+    @contextlib.contextmanager
+    def profile(self, path=None, limit=25):
+        # Run a block under cProfile. The slowest functions by cumulative time are logged at
+        # INFO level and the raw stats are saved to path (for pstats or snakeviz) if given.
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            if path:
+                profiler.dump_stats(path)
+            if logger.isEnabledFor(logging.INFO):
+                output = io.StringIO()
+                pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+                logger.info("Profile:\n%s", output.getvalue())
+
+
+metrics = Metrics()
+
+
+_COMBINING_MARKS = re.compile('[̀-ͯ]')
+_BLANKS = {ord(char): ' ' for char in '\t\r\x0b\x0c\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004'
+           '\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'}
+
+
+class InvoiceSearchIndex:
+    # Case- and accent-insensitive search over name, city, invoice number and description.
+    #
+    # The normalized search text of every row is kept as one line of a single large string,
+    # with the start offset of each line in an array. A query then becomes a few str.find
+    # calls over that string instead of a str.contains loop over every row. Rows added after
+    # the index was built are kept in a short list and merged into the string in batches.
+    # The result of the previous query is remembered, so typing one more character only
+    # re-checks the rows that matched before.
+    FIELDS = ('Name', 'City', 'Invoice Number', 'Description')
+
+    def __init__(self, df, merge_size=5000):
+        self.merge_size = merge_size
+        self._corpus = ''
+        self._offsets = array('q', [0])
+        self._recent = []
+        self._last = None
+
+        if len(df):
+            columns = []
+            for field in self.FIELDS:
+                if field in df.columns:
+                    column = df[field].astype(object)
+                    columns.append(column.where(column.notna(), '').astype(str).tolist())
+
+            # Normalizing the joined text in one go is much faster than row by row
+            lines = [' ' + ' '.join(values) for values in zip(*columns)]
+            corpus = '\n'.join(lines)
+            if corpus.count('\n') != len(lines) - 1:
+                corpus = '\n'.join(line.replace('\n', ' ') for line in lines)
+            self._merge(self.normalize(corpus).split('\n'))
+
+    @staticmethod
+    def normalize(text):
+        # Strip accents, fold case and collapse blanks; line breaks are left alone
+        if not text.isascii():
+            text = _COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text))
+        text = text.casefold().translate(_BLANKS)
+        while '  ' in text:
+            text = text.replace('  ', ' ')
+        return text
+
+    def __len__(self):
+        return len(self._offsets) - 1 + len(self._recent)
+
+    def _merge(self, lines):
+        if not lines:
+            return
+        ends = np.cumsum(np.fromiter(map(len, lines), dtype=np.int64, count=len(lines)) + 1) + self._offsets[-1]
+        self._offsets.frombytes(ends.astype(np.int64).tobytes())
+        self._corpus = self._corpus + '\n'.join(lines) + '\n'
+
+    @classmethod
+    def row_text(cls, row):
+        # The normalized search text of one booking row (a dict)
+        line = ''.join(' ' + ('' if row.get(field) is None or row.get(field) != row.get(field) else str(row.get(field)))
+                       for field in cls.FIELDS)
+        return cls.normalize(line.replace('\n', ' '))
+
+    def add(self, row):
+        self._recent.append(self.row_text(row))
+        if len(self._recent) >= self.merge_size:
+            self._merge(self._recent)
+            self._recent = []
+
+    def _contains(self, row, query):
+        indexed_rows = len(self._offsets) - 1
+        if row < indexed_rows:
+            return self._corpus.find(query, self._offsets[row], self._offsets[row + 1]) != -1
+        return query in self._recent[row - indexed_rows]
+
+    def _scan(self, query):
+        rows = []
+        corpus, offsets = self._corpus, self._offsets
+        start = corpus.find(query)
+        while start != -1:
+            row = bisect.bisect_right(offsets, start) - 1
+            rows.append(row)
+            start = corpus.find(query, offsets[row + 1])
+
+        indexed_rows = len(offsets) - 1
+        rows.extend(indexed_rows + index for index, line in enumerate(self._recent) if query in line)
+        return rows
+
+    def search(self, query, prefix=False):
+        # Row positions of all matching rows in ledger order. With prefix=True the query has
+        # to match the start of a word.
+        query = self.normalize(query.replace('\n', ' ')).strip()
+        if not query:
+            return list(range(len(self)))
+        if prefix:
+            query = ' ' + query
+
+        # Every row matching the new query also matched any query contained in it
+        if self._last is not None and self._last[0] in query:
+            last_query, last_rows, last_size = self._last
+            candidates = last_rows + list(range(last_size, len(self)))
+            rows = [row for row in candidates if self._contains(row, query)]
+        else:
+            rows = self._scan(query)
+
+        self._last = (query, rows, len(self))
+        return rows
+
+
+def _day_number(value):
+    # Days since 1970-01-01 for a date, datetime or date string, or None if it isn't a valid date
+    if value is None or value != value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.strptime(value[:10], "%Y-%m-%d")
+        except ValueError:
+            value = pd.to_datetime(value, errors='coerce')
+            if value is pd.NaT:
+                return None
+    return int(np.datetime64(value, 'D').astype(np.int64))
+
+
+def _invoice_number_value(invoice_number):
+    # The numeric part of an invoice number like 's42', or 0 for anything else
+    if isinstance(invoice_number, str) and invoice_number.startswith('s') and invoice_number[1:].isdigit():
+        return int(invoice_number[1:])
+    return 0
+
+
+_INVOICE_NUMBER = re.compile(r's(0|[1-9][0-9]*)')
+
+
+def _invoice_key(invoice_number):
+    # Invoice numbers 's<N>' are stored as the integer N in the typed ledger and keyed the
+    # same way in its index; anything else is kept as it is
+    if isinstance(invoice_number, str) and _INVOICE_NUMBER.fullmatch(invoice_number):
+        return int(invoice_number[1:])
+    return invoice_number
+
+
+_ISO_DATES = re.compile(r'(?:[0-9]{4}-[0-9]{2}-[0-9]{2}\n)*')
+_INVOICE_NUMBERS = re.compile(r'(?:s(?:0|[1-9][0-9]*)\n)*')
+
+
+def _all_match(pattern, values):
+    # Whether every value is a string matching pattern (which matches newline-terminated
+    # lines); one regex over the joined values is much faster than one match per value
+    try:
+        text = '\n'.join(values) + '\n'
+    except TypeError:
+        return False
+    return text.count('\n') == len(values) and pattern.fullmatch(text) is not None
+
+
+def _typed_column(values, kind):
+    # The typed version of a column of CSV values, or the values as text if any of them
+    # wouldn't convert back to exactly the same text
+    if kind == 'category':
+        return values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category')
+    if kind == 'number':
+        if values.dtype.kind == 'f':
+            return values
+        if values.dtype.kind in 'iub':
+            return values.astype('float64')
+        # Text from a CSV. Amounts, rates and hours repeat a lot, so every distinct text is
+        # converted once. The column is only typed if it would be written back the same way,
+        # which rules out '2.0' (written back as '2') or '0' next to '50.5' (as '0.0').
+        codes, distinct = pd.factorize(values)  # missing values get code -1
+        distinct = pd.Series(distinct, dtype=object)
+        present = distinct != ''  # the CSV can't tell an empty string from a missing value
+        numbers = pd.to_numeric(distinct.where(present), errors='coerce').astype('float64')
+        if numbers[present].isna().any():
+            return values.astype(object)
+        if not (_text_column(numbers[present], kind).astype(str) == distinct[present].astype(str)).all():
+            return values.astype(object)
+        return pd.Series(np.append(numbers.to_numpy(), np.nan)[codes], index=values.index)
+    if kind == 'date':
+        if values.dtype.kind == 'M':
+            return values
+        present = values.notna() & (values != '')
+        if not _all_match(_ISO_DATES, values[present].tolist()):
+            return values.astype(object)
+        typed = pd.to_datetime(values.where(present), format='%Y-%m-%d', errors='coerce')
+        return values.astype(object) if typed[present].isna().any() else typed
+    if kind == 'invoice_number':
+        if values.dtype.kind == 'i':
+            return values
+        if not _all_match(_INVOICE_NUMBERS, values.tolist()):
+            return values.astype(object)
+        return values.str[1:].astype('int64')
+    return values.astype(object)
+
+
+def _text_column(values, kind):
+    # The CSV form of a typed column. Numbers are left as they are, except that a column of
+    # whole numbers is written without decimal points.
+    if values.dtype == object:
+        return values
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(object)
+    if kind == 'invoice_number' and values.dtype.kind == 'i':
+        return pd.Series([f's{number}' for number in values.tolist()], index=values.index, dtype=object)
+    if values.dtype.kind == 'M':
+        days = values.to_numpy().astype('datetime64[D]')
+        missing = np.isnat(days)
+        numbers = days[~missing].astype(np.int64)
+        if len(numbers) and numbers.max() - numbers.min() < 100000:
+            # Bookings span a few years, so formatting each day in the range once and
+            # looking the dates up is much faster than formatting every row
+            first = numbers.min()
+            names = np.datetime_as_string(np.arange(first, numbers.max() + 1).astype('datetime64[D]'))
+            text = np.full(len(days), np.nan, dtype=object)
+            text[~missing] = names.astype(object)[numbers - first]
+        else:
+            text = np.datetime_as_string(days).astype(object)
+            text[missing] = np.nan
+        return pd.Series(text, index=values.index)
+    if values.dtype.kind == 'f':
+        array = values.to_numpy()
+        missing = np.isnan(array)
+        present = array[~missing]
+        if (present % 1 == 0).all() and (np.abs(present) < 2 ** 53).all():
+            return pd.Series(pd.arrays.IntegerArray(np.where(missing, 0, array).astype(np.int64), missing),
+                             index=values.index)
+        return values
+    return values.astype(object)
+
+
+def typed_ledger(df):
+    # Convert booking rows in their CSV form (text, numbers, None) to the typed ledger: the
+    # LEDGER_COLUMNS in order followed by any other columns, with cities, countries and
+    # statuses as categoricals, datetime64 dates, float64 amounts, rates and hours, and
+    # invoice numbers 's<N>' as int64 N. The 's' prefix is only added back by text_ledger,
+    # for display and for the CSV.
+    index = pd.RangeIndex(len(df))
+    columns = {}
+    for column in dict.fromkeys(LEDGER_COLUMNS + list(df.columns)):
+        if column in df.columns:
+            values = df[column].reset_index(drop=True)
+        else:
+            values = pd.Series(np.nan, index=index, dtype=object)
+        columns[column] = _typed_column(values, LEDGER_TYPES.get(column))
+    return pd.DataFrame(columns, index=index)
+
+
+def text_ledger(df):
+    # The inverse of typed_ledger: invoice numbers and dates as text, the way the CSV stores
+    # them. typed_ledger(text_ledger(df)) gives df back.
+    text = df.copy(deep=False)
+    for column in df.columns:
+        kind = LEDGER_TYPES.get(column)
+        if kind is not None and df[column].dtype != object:
+            text[column] = _text_column(df[column], kind)
+    return text
+
+
+def _concat_ledgers(first, second):
+    # Append one typed ledger to another. Categories are merged; a column that is typed in
+    # one and text in the other (say a date in another format) is kept as text.
+    index = pd.RangeIndex(len(first) + len(second))
+    columns = {}
+    for column in dict.fromkeys(list(first.columns) + list(second.columns)):
+        kind = LEDGER_TYPES.get(column)
+        parts = [df[column] if column in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+                 for df in (first, second)]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            if parts[0].cat.categories.dtype != parts[1].cat.categories.dtype:
+                parts = [part.astype(pd.CategoricalDtype(part.cat.categories.astype(object))) for part in parts]
+            values = pd.Series(pd.api.types.union_categoricals(parts, ignore_order=True))
+        elif parts[0].dtype == parts[1].dtype:
+            values = pd.concat(parts, ignore_index=True)
+        else:
+            values = pd.concat([_text_column(part, kind) for part in parts], ignore_index=True)
+        columns[column] = values.set_axis(index)
+    return pd.DataFrame(columns, index=index)
+
+
+def read_ledger_csv(path):
+    # Read a booking CSV into the typed ledger. Categorical columns are parsed straight into
+    # categoricals, everything else is read as text so nothing (leading zeros in postal
+    # codes, or how a number was written) is lost before it is converted. The file is parsed
+    # in one go: categories parsed chunk by chunk can't be merged when a chunk has none.
+    dtypes = {column: 'category' for column, kind in LEDGER_TYPES.items() if kind == 'category'}
+    df = pd.read_csv(path, dtype=defaultdict(lambda: object, dtypes), keep_default_na=False, na_values=[''],
+                     low_memory=False)
+    return typed_ledger(df)
+
+
+def write_ledger_csv(df, path):
+    text_ledger(df).to_csv(path, index=False)
+
+
+def _ledger_keys(df):
+    # The invoice numbers of a typed ledger as index keys (see _invoice_key)
+    numbers = df['Invoice Number']
+    return numbers if numbers.dtype.kind == 'i' else numbers.map(_invoice_key)
+
+
+class DueDateIndex:
+    # Outstanding invoices sorted by due date. Every entry packs the due date (as a day
+    # number) and the row position into one integer, so the index is a plain sorted list of
+    # ints that bisect can search and update in place.
+    def __init__(self, due_dates, positions):
+        due_days = pd.to_datetime(pd.Series(due_dates), errors='coerce').to_numpy().astype('datetime64[D]')
+        valid = ~np.isnat(due_days)
+        keys = (due_days[valid].astype(np.int64) << 32) | np.asarray(positions, dtype=np.int64)[valid]
+        self._keys = np.sort(keys).tolist()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, due_day, position):
+        if due_day is not None:
+            bisect.insort(self._keys, (due_day << 32) | position)
+
+    def remove(self, due_day, position):
+        if due_day is None:
+            return
+        key = (due_day << 32) | position
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            del self._keys[index]
+
+    def positions(self, start_day=None, end_day=None):
+        # Row positions of invoices due on or after start_day and before end_day, by due date
+        start = 0 if start_day is None else bisect.bisect_left(self._keys, start_day << 32)
+        end = len(self._keys) if end_day is None else bisect.bisect_left(self._keys, end_day << 32)
+        return np.array(self._keys[start:end], dtype=np.int64) & 0xFFFFFFFF
+
+
+class LedgerAggregates:
+    # Rollups of the ledger for reports and the dashboard: per customer, per month and per
+    # ISO week of the invoice date and per status, the number of invoices, the amount
+    # invoiced, received (paid) and outstanding, and the hours billed.
+    #
+    # They are built once, from ledger rows and from rollups that were computed elsewhere
+    # (the archive keeps them per partition, SQLite computes them with GROUP BY), and then
+    # kept up to date one row at a time as invoices are created or change status, so no
+    # report scans the ledger again. The result table of every rollup is cached; a change
+    # only marks the keys it touched, and the next query rewrites just those rows of the
+    # cached table.
+    DIMENSIONS = ('customer', 'month', 'week', 'status')
+    MEASURES = ('invoices', 'invoiced', 'received', 'outstanding', 'hours')
+
+    def __init__(self, df=None, rollups=()):
+        self._rollups = {dimension: {} for dimension in self.DIMENSIONS}  # key -> list of MEASURES
+        self._tables = dict.fromkeys(self.DIMENSIONS)  # cached result of rollup()
+        self._changed = {dimension: set() for dimension in self.DIMENSIONS}  # keys changed since
+        if df is not None and len(df):
+            self._build(df)
+        for other in rollups:
+            self._merge(other)
+
+    @property
+    def rollups(self):
+        # {dimension: {key: [MEASURES]}}, which can be stored as JSON and passed back in
+        return self._rollups
+
+    def _merge(self, rollups):
+        for dimension, keys in rollups.items():
+            for key, values in keys.items():
+                self.add_measures({dimension: key}, values)
+
+    def _build(self, df):
+        # The initial rollups in one vectorized pass
+        amounts = pd.to_numeric(df['Amount'], errors='coerce').fillna(0.0)
+        statuses = df['Status'].astype(object)
+        measures = pd.DataFrame({
+            'invoices': np.ones(len(df), dtype=np.int64),
+            'invoiced': amounts,
+            'received': amounts.where(statuses == 'Paid', 0.0),
+            'outstanding': amounts.where(statuses == 'Outstanding', 0.0),
+            'hours': pd.to_numeric(df['Hours Booked'], errors='coerce').fillna(0.0),
+        })
+        dates = pd.to_datetime(df['Date'], format='%Y-%m-%d', errors='coerce')
+        weeks = dates.dt.isocalendar()
+        groups = {
+            'customer': ([df['Name'].astype(object)], lambda key: key),
+            'month': ([dates.dt.year, dates.dt.month], lambda key: f'{int(key[0]):04d}-{int(key[1]):02d}'),
+            'week': ([weeks['year'].astype('float64'), weeks['week'].astype('float64')], lambda key: f'{int(key[0]):04d}-W{int(key[1]):02d}'),
+            'status': ([statuses], lambda key: key),
+        }
+        for dimension, (by, name) in groups.items():
+            sums = measures.groupby([values.to_numpy() for values in by] if len(by) > 1 else by[0].to_numpy(),
+                                    dropna=True).sum()
+            self._rollups[dimension] = {name(key): [int(values[0])] + values[1:]
+                                        for key, values in zip(sums.index, sums.to_numpy().tolist())}
+
+    @staticmethod
+    def _keys(row):
+        # The key of a booking row (a dict) in every rollup; None where it has none
+        name, status = row.get('Name'), row.get('Status')
+        keys = {'customer': name if isinstance(name, str) else None,
+                'status': status if isinstance(status, str) else None, 'month': None, 'week': None}
+        day = _day_number(row.get('Date'))
+        if day is not None:
+            date = datetime(1970, 1, 1) + timedelta(days=day)
+            year, week, _ = date.isocalendar()
+            keys['month'] = f'{date.year:04d}-{date.month:02d}'
+            keys['week'] = f'{year:04d}-W{week:02d}'
+        return keys
+
+    def _apply(self, row, sign):
+        amount = BookingLedger._amount(row.get('Amount'))
+        status = row.get('Status')
+        change = (sign, sign * amount, sign * amount if status == 'Paid' else 0.0,
+                  sign * amount if status == 'Outstanding' else 0.0, sign * BookingLedger._amount(row.get('Hours Booked')))
+        self.add_measures(self._keys(row), change)
+
+    def add_measures(self, keys, measures):
+        # Add the MEASURES of a group of invoices (negative to take them out) to the rollups,
+        # under a key per dimension (None or missing for none)
+        for dimension, key in keys.items():
+            if key is None:
+                continue
+            values = self._rollups[dimension].setdefault(key, [0, 0.0, 0.0, 0.0, 0.0])
+            for index, delta in enumerate(measures):
+                values[index] += delta
+            if values[0] <= 0:
+                del self._rollups[dimension][key]
+            self._changed[dimension].add(key)
+
+    def add(self, row):
+        self._apply(row, 1)
+
+    def remove(self, row):
+        self._apply(row, -1)
+
+    def change_status(self, row, old_status, status):
+        if old_status != status:
+            self._apply(dict(row, Status=old_status), -1)
+            self._apply(dict(row, Status=status), 1)
+
+    def rollup(self, dimension):
+        # DataFrame of the MEASURES per key of a dimension, sorted by key
+        if dimension not in self.DIMENSIONS:
+            raise ValueError(f"Unknown rollup {dimension!r}; expected one of {', '.join(self.DIMENSIONS)}.")
+        rollup = self._rollups[dimension]
+        table = self._tables[dimension]
+        changed = self._changed[dimension]
+        if table is None or changed:
+            if table is None:
+                keys = sorted(rollup)
+            else:
+                table = table.drop(index=[key for key in changed if key in table.index])
+                keys = sorted(key for key in changed if key in rollup)
+            rows = pd.DataFrame([rollup[key] for key in keys], index=keys, columns=list(self.MEASURES), dtype=float)
+            rows['invoices'] = rows['invoices'].astype(np.int64)
+            table = rows if table is None else pd.concat([table, rows]).sort_index()
+            table.index.name = dimension
+            changed.clear()
+            self._tables[dimension] = table
+        return table.copy()
+
+    def differences(self, other):
+        # The dimensions whose rollups differ from other's, allowing for rounding
+        differences = []
+        for dimension in self.DIMENSIONS:
+            mine, theirs = self.rollup(dimension), other.rollup(dimension)
+            if not (mine.index.equals(theirs.index) and np.allclose(mine, theirs, rtol=1e-9, atol=1e-6)):
+                differences.append(dimension)
+        return differences
+
+
+class BookingStorage:
+    # Interface of the storage behind InvoiceManager. Rows are dicts with the LEDGER_COLUMNS;
+    # queries return DataFrames with those columns in ledger order, in their text form as in
+    # the CSV. df is the whole ledger as a typed DataFrame (see typed_ledger). Dates are
+    # passed as day numbers (see _day_number). BookingLedger keeps the ledger in
+    # memory on top of a CSV file, SqliteBookingStorage keeps it in an SQLite database.
+    @property
+    def df(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, invoice_number):
+        raise NotImplementedError
+
+    def rows(self, start=None, stop=None):
+        # A slice of the ledger, like df.iloc[start:stop]
+        return text_ledger(self.df.iloc[start:stop])
+
+    def get(self, invoice_number):
+        # The booking row of one invoice as a single-row DataFrame, or None if it doesn't exist
+        raise NotImplementedError
+
+    def total(self, status):
+        raise NotImplementedError
+
+    def search(self, query, prefix=False):
+        raise NotImplementedError
+
+    def due_between(self, start_day=None, end_day=None):
+        # Outstanding invoices due on or after start_day and before end_day (None for no
+        # limit), sorted by due date
+        raise NotImplementedError
+
+    def iter_due_between(self, start_day=None, end_day=None, chunk_size=1000):
+        # Same as due_between, in DataFrames of at most chunk_size rows
+        raise NotImplementedError
+
+    def aging(self, today_day):
+        # {bucket: {'count': ..., 'amount': ...}} of outstanding invoices per AGING_BUCKETS
+        raise NotImplementedError
+
+    def rollup(self, dimension):
+        # Invoices, amounts and hours per customer, month, ISO week or status, see
+        # LedgerAggregates.rollup
+        return LedgerAggregates(self.df).rollup(dimension)
+
+    def check_consistency(self):
+        # A list of problems found in the stored data; an empty list means everything is fine
+        raise NotImplementedError
+
+    def reserve_invoice_numbers(self, count):
+        # Hand out a contiguous block of unused invoice numbers and return the first one
+        raise NotImplementedError
+
+    def next_invoice_number(self):
+        raise NotImplementedError
+
+    def append_invoice(self, row):
+        self.append_invoices([row])
+
+    def append_invoices(self, rows):
+        raise NotImplementedError
+
+    def update_status(self, invoice_number, status):
+        # Returns False if the invoice doesn't exist
+        raise NotImplementedError
+
+    def compact(self):
+        pass
+
+    def archive(self, before_day=None):
+        # Move closed invoices dated before before_day (a day number) out of the hot storage
+        # and return how many were moved; storage that is indexed on disk keeps them
+        return 0
+
+    def export_csv(self, path):
+        write_ledger_csv(self.df, path)
+
+    def close(self):
+        pass
+
+
+class _FileLock:
+    # Exclusive lock on a lock file, held by at most one process at a time. It is re-entrant
+    # within a process; callers serialize their own threads.
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            if self._file is None:
+                self._file = open(self.path, 'a+b')
+            if os.name == 'nt':
+                self._file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass  # LK_LOCK gives up after ten seconds
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            if os.name == 'nt':
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LedgerArchive:
+    # Cold partitions of a BookingLedger: closed invoices dated before the hot years, one
+    # partition per year of the invoice date, so the hot CSV (and with it startup time and
+    # memory) only grows with the active business.
+    #
+    # A partition is a directory with one .npy file per column that is read memory-mapped:
+    # numbers and dates as they are, text dictionary-encoded as codes plus the list of
+    # distinct values in columns.json. A partition is only read when a lookup, search or
+    # export needs it; counts, totals and the highest invoice number come from
+    # manifest.json, which lists the directory, row count, totals per status and invoice
+    # number range of every partition.
+    #
+    # Partition directories are never changed in place: a change writes a new directory and
+    # swaps the manifest atomically. An invoice that goes back to the hot ledger is listed as
+    # excluded until its partition is rewritten. 'moved' lists the invoices of an archive run
+    # that may still be in the hot CSV (see BookingLedger._compact). All writes happen under
+    # the ledger's file lock.
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, 'manifest.json')
+        self._manifest = None  # read on first use
+        self._manifest_state = None
+        self._frames = {}  # year -> typed DataFrame of a partition that has been read
+        self._search_indexes = {}  # year -> InvoiceSearchIndex of a partition
+
+    def _stat(self):
+        try:
+            manifest = os.stat(self.manifest_file)
+        except FileNotFoundError:
+            return None
+        return [manifest.st_size, manifest.st_mtime_ns, manifest.st_ino]
+
+    def changed(self):
+        # Whether another process has changed the archive since the manifest was read
+        return self._manifest is not None and self._stat() != self._manifest_state
+
+    def refresh(self):
+        state = self._stat()
+        manifest = {'generation': 0, 'partitions': {}, 'moved': []}
+        if state is not None:
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+        self._set_manifest(manifest, state)
+
+    def _set_manifest(self, manifest, state):
+        # Partitions that were read stay cached as long as the manifest entry is the same
+        old = self._manifest['partitions'] if self._manifest is not None else {}
+        for year in list(self._frames):
+            if manifest['partitions'].get(year) != old.get(year):
+                del self._frames[year]
+                self._search_indexes.pop(year, None)
+        self._manifest = manifest
+        self._manifest_state = state
+
+    def _replace_manifest(self, manifest):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_file = self.manifest_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(manifest, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.manifest_file)
+        self._set_manifest(manifest, self._stat())
+
+    def _read(self):
+        if self._manifest is None:
+            self.refresh()
+        return self._manifest
+
+    @property
+    def partitions(self):
+        # year (a string) -> manifest entry
+        return self._read()['partitions']
+
+    @property
+    def moved(self):
+        return set(self._read()['moved'])
+
+    def __len__(self):
+        return sum(partition['rows'] for partition in self.partitions.values())
+
+    def total(self, status):
+        return sum(partition['totals'].get(status, 0.0) for partition in self.partitions.values())
+
+    def max_invoice_number(self):
+        return max((partition['max_invoice'] for partition in self.partitions.values()), default=0)
+
+    def partition(self, year):
+        # The typed rows of one partition, without the excluded invoices
+        frame = self._frames.get(year)
+        if frame is None:
+            entry = self.partitions[year]
+            path = os.path.join(self.directory, entry['path'])
+            with open(os.path.join(path, 'columns.json')) as f:
+                layout = json.load(f)
+            columns = {}
+            for number, column in enumerate(layout['columns']):
+                values = np.load(os.path.join(path, f'{number}.npy'), mmap_mode='r')
+                if 'categories' in column:
+                    values = pd.Categorical.from_codes(values, column['categories'])
+                    if LEDGER_TYPES.get(column['name']) != 'category':
+                        values = values.astype(object)
+                columns[column['name']] = values
+            frame = pd.DataFrame(columns, index=pd.RangeIndex(layout['rows']), copy=False)
+            if entry['excluded']:
+                frame = frame[~_ledger_keys(frame).isin(entry['excluded'])].reset_index(drop=True)
+            self._frames[year] = frame
+        return frame
+
+    def frames(self):
+        return [self.partition(year) for year in sorted(self.partitions)]
+
+    def rows(self, start, stop):
+        # Typed rows start to stop (0 <= start < stop <= len) of the partitions in year order
+        frames = []
+        offset = 0
+        for year in sorted(self.partitions):
+            count = self.partitions[year]['rows']
+            if start < offset + count and stop > offset:
+                frames.append(self.partition(year).iloc[max(start - offset, 0):stop - offset])
+            offset += count
+        return frames
+
+    def find(self, key):
+        # (year, row position) of an archived invoice, or None. Invoice numbers grow with the
+        # invoice date, so the number range in the manifest rules out almost every partition.
+        for year, entry in sorted(self.partitions.items()):
+            if key in entry['excluded']:
+                continue
+            if isinstance(key, int) and entry['first'] is not None and not entry['first'] <= key <= entry['last']:
+                continue
+            positions = np.flatnonzero((_ledger_keys(self.partition(year)) == key).to_numpy())
+            if len(positions):
+                return year, int(positions[0])
+        return None
+
+    def get(self, key):
+        # The typed row of an archived invoice as a single-row DataFrame, or None
+        found = self.find(key)
+        if found is None:
+            return None
+        year, position = found
+        return self.partition(year).iloc[[position]]
+
+    def search(self, query, prefix=False):
+        # Matching typed rows of every partition; each partition is indexed on its first search
+        frames = []
+        for year in sorted(self.partitions):
+            index = self._search_indexes.get(year)
+            if index is None:
+                fields = self.partition(year)[list(InvoiceSearchIndex.FIELDS)]
+                index = self._search_indexes[year] = InvoiceSearchIndex(text_ledger(fields))
+            positions = index.search(query, prefix)
+            if positions:
+                frames.append(self.partition(year).iloc[positions])
+        return frames
+
+    def rollups(self):
+        # The LedgerAggregates rollups of every partition, from the manifest. Archives written
+        # before the manifest kept them are rolled up from their partitions.
+        return [entry['rollups'] if 'rollups' in entry else LedgerAggregates(self.partition(year)).rollups
+                for year, entry in sorted(self.partitions.items())]
+
+    def keys(self):
+        for frame in self.frames():
+            yield from _ledger_keys(frame).tolist()
+
+    @staticmethod
+    def _entry(frame, path):
+        numbers = [key for key in _ledger_keys(frame).tolist() if isinstance(key, int)]
+        return {'path': path, 'rows': len(frame), 'excluded': [], 'totals': BookingLedger._compute_totals(frame),
+                'rollups': LedgerAggregates(frame).rollups, 'first': min(numbers, default=None),
+                'last': max(numbers, default=None), 'max_invoice': max(numbers, default=0)}
+
+    def _write_partition(self, frame, path):
+        os.makedirs(path)
+        layout = []
+        for number, (name, values) in enumerate(frame.items()):
+            column = {'name': name}
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                data = values.cat.codes.to_numpy()
+                column['categories'] = values.cat.categories.tolist()
+            elif isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biufM':
+                data = values.to_numpy()
+            else:
+                codes, distinct = pd.factorize(values.astype(object))
+                data = codes.astype(np.int32)
+                column['categories'] = distinct.tolist()
+            with open(os.path.join(path, f'{number}.npy'), 'wb') as f:
+                np.save(f, data)
+                f.flush()
+                os.fsync(f.fileno())
+            layout.append(column)
+        with open(os.path.join(path, 'columns.json'), 'w') as f:
+            json.dump({'rows': len(frame), 'columns': layout}, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, df):
+        # Add typed hot rows to the partitions of their invoice year and record them as moved.
+        # Years that already have a partition are rewritten with the new rows appended.
+        manifest = json.loads(json.dumps(self._read()))
+        manifest['generation'] += 1
+        years = pd.to_datetime(df['Date'], errors='coerce').dt.year
+        for year, rows in df.groupby(years.to_numpy(), sort=True):
+            year = str(int(year))
+            rows = rows.reset_index(drop=True)
+            if year in self.partitions:
+                rows = _concat_ledgers(self.partition(year), rows)
+            path = f'{year}-{manifest["generation"]}'
+            self._write_partition(rows, os.path.join(self.directory, path))
+            manifest['partitions'][year] = self._entry(rows, path)
+        manifest['moved'] = list(dict.fromkeys(manifest['moved'] + _ledger_keys(df).tolist()))
+        self._replace_manifest(manifest)
+        self._remove_unused()
+
+    def exclude(self, key):
+        # Take an invoice out of the archive because it goes back to the hot ledger; nothing
+        # happens if it isn't archived (any more)
+        found = self.find(key)
+        if found is None:
+            return
+        year, position = found
+        row = self.partition(year).iloc[position]
+        manifest = json.loads(json.dumps(self._manifest))
+        entry = manifest['partitions'][year]
+        entry['excluded'].append(key)
+        entry['rows'] -= 1
+        if row['Status'] in entry['totals']:
+            entry['totals'][row['Status']] -= BookingLedger._amount(row['Amount'])
+        if 'rollups' in entry:
+            aggregates = LedgerAggregates(rollups=[entry['rollups']])
+            aggregates.remove(row.to_dict())
+            entry['rollups'] = aggregates.rollups
+        self._replace_manifest(manifest)
+
+    def clear_moved(self):
+        self._replace_manifest(dict(self._read(), moved=[]))
+
+    def _remove_unused(self):
+        # Directories of partitions that have been rewritten. A process may still have them
+        # memory-mapped, which only stops the removal on Windows; they go on a later run.
+        used = {entry['path'] for entry in self.partitions.values()}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name not in used and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def check_consistency(self):
+        problems = []
+        for year, entry in sorted(self.partitions.items()):
+            frame = self.partition(year)
+            if len(frame) != entry['rows']:
+                problems.append(f"Archive {year} has {len(frame)} invoices, its manifest says {entry['rows']}.")
+            totals = BookingLedger._compute_totals(frame)
+            for status in set(totals) | set(entry['totals']):
+                if not math.isclose(totals.get(status, 0.0), entry['totals'].get(status, 0.0), rel_tol=1e-9, abs_tol=1e-6):
+                    problems.append(f"Archive {year} total for status {status!r} is {entry['totals'].get(status, 0.0)}, "
+                                    f"its invoices sum to {totals.get(status, 0.0)}.")
+            if 'rollups' in entry:
+                for dimension in LedgerAggregates(rollups=[entry['rollups']]).differences(LedgerAggregates(frame)):
+                    problems.append(f"Archive {year} rollup per {dimension} doesn't match its invoices.")
+        return problems
+
+
+class BookingLedger(BookingStorage):
+    # Append-only storage for the booking data.
+    #
+    # The booking CSV is a snapshot of the ledger. Every mutation after the snapshot is
+    # appended as a single JSON line to a journal file next to it, so creating an invoice
+    # or changing its status costs one small write instead of rewriting the whole CSV.
+    # Loading replays the journal on top of the snapshot and compact() folds the journal
+    # back into the CSV. Replaying is idempotent, so a crash at any point during a write
+    # or a compaction never loses or duplicates invoices.
+    #
+    # A hash index from invoice number to row and running amount totals per status are kept
+    # up to date on every mutation, so lookups and totals don't scan the ledger. All public
+    # methods are thread-safe.
+    #
+    # The snapshot and journal are only read when the ledger is first queried. Appending
+    # before that just writes to the journal, so a script that creates an invoice never has
+    # to parse the whole ledger.
+    #
+    # Several processes can share a ledger. Every write to the journal, snapshot or sequence
+    # file happens under an exclusive lock on a lock file next to the CSV. Before answering
+    # a query the ledger checks whether the files have changed: new journal records written
+    # by another process are applied, and a compaction (a new snapshot file) makes it reload.
+    #
+    # The sequence file holds the next free invoice number, together with the size of the
+    # snapshot and journal it was written for. Invoices appended since are picked up from
+    # the journal tail; if the snapshot changed behind its back (or there is no sequence
+    # file) the number is recomputed from the whole ledger. Each process reserves numbers
+    # from it in blocks of number_block, so creating invoices rarely touches the file.
+    # Unused numbers are handed back on close() if no other process has reserved since.
+    #
+    # Compaction also moves closed invoices dated before the last hot_years years (None to
+    # keep everything hot) to a LedgerArchive next to the CSV, so the CSV only holds
+    # outstanding and recent invoices. Counts and totals include the archive without reading
+    # it; lookups, searches, paging and exports read the archive partitions they touch.
+    def __init__(self, booking_file, compact_threshold=10000, fsync=True, number_block=20, hot_years=1):
+        self.booking_file = booking_file
+        self.path = booking_file
+        self.journal_file = booking_file + '.journal'
+        self.sequence_file = booking_file + '.seq'
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.number_block = number_block
+        self.hot_years = hot_years
+
+        self._df = None
+        self._pending = []  # rows appended since the DataFrame was last materialized
+        self._positions = {}  # invoice number (see _invoice_key) -> row position
+        self._totals = {}  # status -> total amount
+        self._search_index = None  # built on the first search
+        self._due_index = None  # outstanding invoices by due date, built on first use
+        self._aggregates = None  # LedgerAggregates, built on the first report
+        self._journal_records = 0
+        self._journal = None
+        self._loaded = False
+        self._snapshot_state = None  # (size, mtime, inode) of the snapshot that was loaded
+        self._journal_offset = 0  # bytes of the journal that have been applied
+        self._next_number = None  # next number in the reserved block
+        self._block_end = None
+        self._lock = threading.RLock()
+        self._file_lock = _FileLock(booking_file + '.lock')
+        self._archive = LedgerArchive(booking_file + '.archive')
+
+        self._journal = open(self.journal_file, 'ab')
+
+    def _snapshot_stat(self):
+        try:
+            snapshot = os.stat(self.booking_file)
+        except FileNotFoundError:
+            return None
+        return [snapshot.st_size, snapshot.st_mtime_ns, snapshot.st_ino]
+
+    def _load(self):
+        # Load the ledger on first use, afterwards pick up what other processes have written
+        if self._loaded:
+            snapshot_state = self._snapshot_stat()
+            if (snapshot_state == self._snapshot_state and not self._archive.changed()
+                    and os.fstat(self._journal.fileno()).st_size == self._journal_offset):
+                return
+
+        with self._file_lock:
+            if (self._loaded and self._snapshot_stat() == self._snapshot_state and not self._archive.changed()
+                    and os.fstat(self._journal.fileno()).st_size >= self._journal_offset):
+                self._replay_journal()
+                return
+
+            self._loaded = True
+            self._journal_records = 0
+            self._journal_offset = 0
+            self._aggregates = None
+            self._archive.refresh()
+            self._load_snapshot()
+            self._snapshot_state = self._snapshot_stat()
+            self._replay_journal()
+            if self._archive.moved:
+                # An archive run stopped before it could take its invoices out of the CSV
+                self._compact(None)
+
+    @property
+    def _hot_df(self):
+        # The loaded ledger without the archive. New rows are buffered and concatenated in
+        # one go on first read, which keeps appends O(1) when many invoices are created
+        # between two reads.
+        #
+        # This doesn't pick up other processes' changes: every public query calls _load()
+        # once at the start and then works on that state, because a reload in the middle
+        # replaces the frame and drops the indexes it has already read.
+        with self._lock:
+            if self._pending:
+                new_rows = typed_ledger(pd.DataFrame(self._pending))
+                self._df = _concat_ledgers(self._df, new_rows) if len(self._df) else new_rows
+                self._pending = []
+            return self._df
+
+    @property
+    def df(self):
+        # The whole ledger: the archive partitions in year order, then the hot ledger
+        with self._lock:
+            self._load()
+            df = self._hot_df
+            for frame in reversed(self._archive.frames()):
+                df = _concat_ledgers(frame, df)
+            return df
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._archive) + self._row_count()
+
+    def _row_count(self):
+        return len(self._df) + len(self._pending)
+
+    def __contains__(self, invoice_number):
+        with self._lock:
+            self._load()
+            key = _invoice_key(invoice_number)
+            return key in self._positions or self._archive.find(key) is not None
+
+    def _load_snapshot(self):
+        if os.path.exists(self.booking_file):
+            self._set_snapshot(read_ledger_csv(self.booking_file))
+        else:
+            self._set_snapshot(typed_ledger(pd.DataFrame(columns=LEDGER_COLUMNS)))
+            write_ledger_csv(self._df, self.booking_file)
+
+    def _set_snapshot(self, df):
+        # Start over from a snapshot that was just read or written
+        self._df = df
+        self._pending = []
+        self._positions = {key: position for position, key in enumerate(_ledger_keys(df).tolist())}
+        self._totals = self._compute_totals(df) if len(df) else {}
+        self._search_index = None
+        self._due_index = None
+
+    def _replay_journal(self):
+        # Apply the journal from the last applied record on; called under the file lock
+        if not os.path.exists(self.journal_file):
+            return
+
+        with open(self.journal_file, 'rb') as journal:
+            journal.seek(self._journal_offset)
+            data = journal.read()
+
+        valid_length = 0
+        for line in data.splitlines(keepends=True):
+            # A line without a newline or with broken JSON is a write torn by a crash;
+            # everything before it is intact.
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            self._apply(record)
+            self._journal_records += 1
+            valid_length += len(line)
+
+        self._journal_offset += valid_length
+        if valid_length < len(data):
+            logger.warning("Discarding %d bytes of incomplete journal data in %s", len(data) - valid_length,
+                           self.journal_file)
+            with open(self.journal_file, 'r+b') as journal:
+                journal.truncate(self._journal_offset)
+
+    def journal_records(self, offset=0):
+        # The complete records in the journal from a byte offset on, without loading the ledger
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'rb') as journal:
+            journal.seek(offset)
+            for line in journal:
+                if not line.endswith(b'\n'):
+                    return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+
+    @staticmethod
+    def _compute_totals(df):
+        amounts = pd.to_numeric(df['Amount'], errors='coerce').fillna(0)
+        return {status: float(total) for status, total in amounts.groupby(df['Status'], observed=True).sum().items()}
+
+    @staticmethod
+    def _amount(value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return 0.0
+        return value if value == value else 0.0
+
+    def _value(self, position, column):
+        if position >= len(self._df):
+            return self._pending[position - len(self._df)].get(column)
+        return self._df.at[position, column]
+
+    def _apply(self, record):
+        if record['op'] == 'create':
+            row = record['row']
+            key = _invoice_key(row['Invoice Number'])
+            if key in self._positions:
+                return
+            self._positions[key] = self._row_count()
+            self._pending.append(row)
+            if self._search_index is not None:
+                self._search_index.add(row)
+            if self._due_index is not None and row['Status'] == 'Outstanding':
+                self._due_index.add(_day_number(row['Due Date']), self._row_count() - 1)
+            if self._aggregates is not None:
+                self._aggregates.add(row)
+            self._totals[row['Status']] = self._totals.get(row['Status'], 0.0) + self._amount(row['Amount'])
+        elif record['op'] == 'status':
+            self._set_status(record['invoice'], record['status'])
+        elif record['op'] == 'restore':
+            # An archived invoice whose status changed: it leaves the archive for the hot
+            # ledger. Replaying this finishes the move if it was interrupted.
+            key = _invoice_key(record['row']['Invoice Number'])
+            if self._aggregates is not None:
+                archived = self._archive.get(key)
+                if archived is not None:
+                    self._aggregates.remove(archived.iloc[0].to_dict())
+            self._archive.exclude(key)
+            self._apply(dict(record, op='create'))
+
+    def _set_status(self, invoice_number, status):
+        position = self._positions.get(_invoice_key(invoice_number))
+        if position is None:
+            return False
+
+        old_status = self._value(position, 'Status')
+        if old_status != status:
+            amount = self._amount(self._value(position, 'Amount'))
+            self._totals[old_status] = self._totals.get(old_status, 0.0) - amount
+            self._totals[status] = self._totals.get(status, 0.0) + amount
+
+            if self._due_index is not None and 'Outstanding' in (old_status, status):
+                due_day = _day_number(self._value(position, 'Due Date'))
+                if status == 'Outstanding':
+                    self._due_index.add(due_day, position)
+                else:
+                    self._due_index.remove(due_day, position)
+
+            if self._aggregates is not None:
+                row = {column: self._value(position, column) for column in ('Name', 'Amount', 'Date', 'Hours Booked')}
+                self._aggregates.change_status(row, old_status, status)
+
+        if position >= len(self._df):
+            self._pending[position - len(self._df)]['Status'] = status
+        else:
+            statuses = self._df['Status']
+            if isinstance(statuses.dtype, pd.CategoricalDtype) and status not in statuses.cat.categories:
+                self._df['Status'] = statuses.cat.add_categories([status])
+            self._df.at[position, 'Status'] = status
+        return True
+
+    def rows(self, start=None, stop=None):
+        # Slices within the hot ledger, like the most recent page of the list, don't read
+        # the archive
+        with self._lock:
+            self._load()
+            archived = len(self._archive)
+            if not archived:
+                return text_ledger(self._hot_df.iloc[start:stop])
+            start, stop, _ = slice(start, stop).indices(archived + self._row_count())
+            frames = self._archive.rows(start, min(stop, archived)) if start < min(stop, archived) else []
+            if stop > archived or not frames:
+                frames.append(self._hot_df.iloc[max(start - archived, 0):max(stop - archived, 0)])
+            return text_ledger(self._combine(frames))
+
+    @staticmethod
+    def _combine(frames):
+        # Typed frames from the archive and the hot ledger as one frame
+        df = frames[0].reset_index(drop=True)
+        for frame in frames[1:]:
+            df = _concat_ledgers(df, frame.reset_index(drop=True))
+        return df
+
+    def get(self, invoice_number):
+        with self._lock:
+            self._load()
+            key = _invoice_key(invoice_number)
+            position = self._positions.get(key)
+            if position is None:
+                row = self._archive.get(key)
+                return None if row is None else text_ledger(row.reset_index(drop=True))
+            return text_ledger(self._hot_df.iloc[[position]])
+
+    def total(self, status):
+        with self._lock:
+            self._load()
+            return self._archive.total(status) + self._totals.get(status, 0.0)
+
+    def search(self, query, prefix=False):
+        # Searches the archive too, which reads and indexes every partition the first time
+        with self._lock:
+            self._load()
+            if self._search_index is None:
+                self._search_index = InvoiceSearchIndex(text_ledger(self._hot_df[list(InvoiceSearchIndex.FIELDS)]))
+            hot = self._hot_df.iloc[self._search_index.search(query, prefix)]
+            return text_ledger(self._combine(self._archive.search(query, prefix) + [hot]))
+
+    def _outstanding_by_due_date(self):
+        # Archived invoices are closed, so only the hot ledger has outstanding ones
+        if self._due_index is None:
+            df = self._hot_df
+            outstanding = (df['Status'] == 'Outstanding').to_numpy(dtype=bool, na_value=False)
+            self._due_index = DueDateIndex(df['Due Date'].to_numpy()[outstanding], np.flatnonzero(outstanding))
+        return self._due_index
+
+    def due_between(self, start_day=None, end_day=None):
+        with self._lock:
+            self._load()
+            return text_ledger(self._hot_df.iloc[self._outstanding_by_due_date().positions(start_day, end_day)])
+
+    def iter_due_between(self, start_day=None, end_day=None, chunk_size=1000):
+        # The positions belong to the frame they were found in, so that frame is kept for
+        # the remaining chunks even if another query reloads the ledger in between
+        with self._lock:
+            self._load()
+            df = self._hot_df
+            positions = self._outstanding_by_due_date().positions(start_day, end_day)
+        for start in range(0, len(positions), chunk_size):
+            with self._lock:
+                chunk = text_ledger(df.iloc[positions[start:start + chunk_size]])
+            yield chunk
+
+    def aging(self, today_day):
+        with self._lock:
+            self._load()
+            index = self._outstanding_by_due_date()
+            amounts = self._hot_df['Amount'].to_numpy()
+            report = {}
+            for label, min_days, max_days in AGING_BUCKETS:
+                start_day = None if max_days is None else today_day - max_days
+                positions = index.positions(start_day, today_day - min_days + 1)
+                bucket_amounts = pd.to_numeric(pd.Series(amounts[positions]), errors='coerce')
+                report[label] = {'count': len(positions), 'amount': float(bucket_amounts.sum())}
+            return report
+
+    def rollup(self, dimension):
+        # Archived invoices are counted from the rollups in the archive manifest, so this
+        # doesn't read the archive. After the first query the rollups are kept up to date.
+        with self._lock:
+            self._load()
+            if self._aggregates is None:
+                self._aggregates = LedgerAggregates(self._hot_df, self._archive.rollups())
+            return self._aggregates.rollup(dimension)
+
+    def check_consistency(self):
+        # Compare the index and the running totals with the raw data, and the archive with
+        # its manifest
+        with self._lock:
+            self._load()
+            problems = []
+            df = self._hot_df
+            numbers = text_ledger(df[['Invoice Number']])['Invoice Number'].tolist()
+            if len(self._positions) != len(numbers):
+                problems.append(f"Index has {len(self._positions)} invoices, ledger has {len(numbers)} rows.")
+            for position, number in enumerate(numbers):
+                indexed = self._positions.get(_invoice_key(number))
+                if indexed != position:
+                    problems.append(f"Invoice {number} at row {position} is indexed at row {indexed}.")
+
+            expected = self._compute_totals(df)
+            for status in set(expected) | set(self._totals):
+                if not math.isclose(expected.get(status, 0.0), self._totals.get(status, 0.0), rel_tol=1e-9, abs_tol=1e-6):
+                    problems.append(f"Total for status {status!r} is {self._totals.get(status, 0.0)}, "
+                                    f"ledger sums to {expected.get(status, 0.0)}.")
+
+            problems += self._archive.check_consistency()
+            for key in self._archive.keys():
+                if key in self._positions:
+                    problems.append(f"Invoice {key} is both archived and in the ledger.")
+
+            if self._aggregates is not None:
+                for dimension in self._aggregates.differences(LedgerAggregates(self.df)):
+                    problems.append(f"Rollup per {dimension} doesn't match the ledger.")
+            return problems
+
+    def _write(self, records):
+        # Append records to the journal under the file lock. A loaded ledger first applies
+        # what other processes have written, so its records follow theirs.
+        data = b''.join(json.dumps(record, default=str).encode('utf-8') + b'\n' for record in records)
+        with self._file_lock:
+            if self._loaded:
+                self._load()
+            elif os.fstat(self._journal.fileno()).st_size > 0:
+                # A crash may have left a torn record at the end of the journal; load (which
+                # truncates it) rather than appending behind it
+                with open(self.journal_file, 'rb') as journal:
+                    journal.seek(-1, os.SEEK_END)
+                    if journal.read(1) != b'\n':
+                        self._load()
+
+            with metrics.stage('ledger_persist'):
+                self._journal.write(data)
+                self._journal.flush()
+                if self.fsync:
+                    os.fsync(self._journal.fileno())
+            if self._loaded:
+                self._journal_offset = os.fstat(self._journal.fileno()).st_size
+
+        self._journal_records += len(records)
+        metrics.count('ledger_records_written', len(records))
+
+    def _maybe_compact(self):
+        if self.compact_threshold and self._journal_records >= self.compact_threshold:
+            self.compact()
+
+    def _file_state(self):
+        journal_size = os.path.getsize(self.journal_file) if os.path.exists(self.journal_file) else 0
+        return self._snapshot_stat(), journal_size
+
+    def _read_counter(self):
+        # The next free invoice number according to the sequence file and the journal
+        # records written since; called under the file lock
+        if not os.path.exists(self.booking_file):
+            self._load()  # creates the snapshot the counter is recorded against
+
+        saved_counter = 1
+        try:
+            with open(self.sequence_file) as f:
+                saved = json.load(f)
+            saved_counter = int(saved['next_invoice_number'])
+            snapshot, journal_size = self._file_state()
+            if snapshot == saved['snapshot'] and journal_size >= saved['journal_size']:
+                counter = saved_counter
+                for record in self.journal_records(saved['journal_size']):
+                    if record.get('op') == 'create':
+                        counter = max(counter, _invoice_number_value(record['row'].get('Invoice Number')) + 1)
+                return counter
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        # Never go below the saved counter: its numbers may be reserved but not used yet
+        self._load()
+        numbers = self._hot_df['Invoice Number']
+        if numbers.dtype == object:
+            numbers = numbers.dropna().astype(str)
+            numbers = pd.to_numeric(numbers[numbers.str.startswith('s')].str[1:], errors='coerce')
+        counter = max(saved_counter, 1 if numbers.isna().all() else int(numbers.max()) + 1,
+                      self._archive.max_invoice_number() + 1)
+        self._write_counter(counter)  # so the next start doesn't have to scan the ledger again
+        return counter
+
+    def _write_counter(self, counter):
+        snapshot, journal_size = self._file_state()
+        temp_file = self.sequence_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump({'next_invoice_number': counter, 'snapshot': snapshot, 'journal_size': journal_size}, f)
+        os.replace(temp_file, self.sequence_file)
+
+    def next_invoice_number(self):
+        with self._lock:
+            if self._next_number is not None and self._next_number < self._block_end:
+                return self._next_number
+            with self._file_lock:
+                return max(1, self._read_counter())
+
+    def reserve_invoice_numbers(self, count):
+        with self._lock:
+            if self._next_number is None or self._next_number + count > self._block_end:
+                with self._file_lock:
+                    counter = max(1, self._read_counter())
+                    # Carry on with the current block if no other process has reserved since
+                    start = self._next_number if self._block_end == counter else counter
+                    self._next_number = start
+                    self._block_end = start + max(count, self.number_block)
+                    self._write_counter(self._block_end)
+
+            first = self._next_number
+            self._next_number += count
+            return first
+
+    def append_invoices(self, rows):
+        with self._lock:
+            if not rows:
+                return
+            records = [{'op': 'create', 'row': row} for row in rows]
+            self._write(records)
+            if self._loaded:
+                for record in records:
+                    self._apply(record)
+                self._maybe_compact()
+
+            # Don't hand out numbers of invoices that were numbered elsewhere
+            highest = max(_invoice_number_value(row.get('Invoice Number')) for row in rows)
+            if self._next_number is not None and highest >= self._next_number:
+                self._next_number = highest + 1
+
+    def update_status(self, invoice_number, status):
+        # Under the file lock, so no other process archives the invoice in between
+        with self._lock, self._file_lock:
+            self._load()
+            key = _invoice_key(invoice_number)
+            if key in self._positions:
+                self._write([{'op': 'status', 'invoice': invoice_number, 'status': status}])
+                self._set_status(invoice_number, status)
+            else:
+                row = self._archive.get(key)
+                if row is None:
+                    return False
+                if row['Status'].iloc[0] == status:
+                    return True
+                # Archived invoices are read-only; the journal gets the whole row back
+                row = json.loads(text_ledger(row).to_json(orient='records', double_precision=15))[0]
+                row['Status'] = status
+                record = {'op': 'restore', 'row': row}
+                self._write([record])
+                self._apply(record)
+            self._maybe_compact()
+            return True
+
+    def _archive_cutoff(self):
+        # Day number of January 1st of the oldest hot year, or None if nothing is archived
+        if self.hot_years is None:
+            return None
+        return _day_number(datetime(datetime.today().year - self.hot_years, 1, 1))
+
+    def compact(self):
+        with self._lock, self._file_lock, metrics.stage('ledger_compact'):
+            self._load()
+            self._compact(self._archive_cutoff())
+
+    def archive(self, before_day=None):
+        # Compact, archiving closed invoices dated before before_day (a day number; default:
+        # before the hot years). Returns the number of invoices archived.
+        with self._lock, self._file_lock, metrics.stage('ledger_compact'):
+            self._load()
+            return self._compact(self._archive_cutoff() if before_day is None else before_day)
+
+    def _compact(self, before_day):
+        # Write the new snapshot next to the old one and swap it in atomically before
+        # clearing the journal; replaying a journal that is already part of the snapshot
+        # is harmless. The sequence file is rewritten for the new snapshot.
+        #
+        # Closed invoices dated before before_day are first written to the archive, whose
+        # manifest records them as moved. Only then are they left out of the snapshot, and
+        # 'moved' is cleared once the snapshot is in place. Loading a ledger that still has
+        # moved invoices compacts again, so a crash never loses or duplicates invoices.
+        # Called under the file lock with the ledger loaded.
+        counter = self._read_counter()
+        df = self._hot_df
+        if before_day is not None and len(df):
+            dates = pd.to_datetime(df['Date'], format='%Y-%m-%d', errors='coerce')
+            closed = df['Status'].notna() & (df['Status'] != 'Outstanding')
+            old = (dates < pd.Timestamp(np.datetime64(before_day, 'D'))).to_numpy()
+            archived = (closed.to_numpy(dtype=bool, na_value=False) & old
+                        & ~_ledger_keys(df).isin(list(self._archive.moved)).to_numpy())
+            if archived.any():
+                self._archive.add(df[archived])
+
+        moved = self._archive.moved
+        if moved:
+            df = df[~_ledger_keys(df).isin(list(moved)).to_numpy()].reset_index(drop=True)
+
+        temp_file = self.booking_file + '.tmp'
+        write_ledger_csv(df, temp_file)
+        with open(temp_file, 'rb') as snapshot:
+            os.fsync(snapshot.fileno())
+        os.replace(temp_file, self.booking_file)
+
+        self._journal.truncate(0)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._snapshot_state = self._snapshot_stat()
+        self._journal_offset = 0
+        self._journal_records = 0
+        if moved:
+            self._set_snapshot(df)
+            self._archive.clear_moved()
+        self._write_counter(counter)
+        return len(moved)
+
+    def export_csv(self, path):
+        with self._lock:
+            write_ledger_csv(self.df, path)
+
+    def close(self):
+        with self._lock:
+            if self._journal is None:
+                return
+            if self._next_number is not None and self._next_number < self._block_end:
+                # Hand back the rest of the block unless another process has reserved since
+                with self._file_lock:
+                    if self._read_counter() == self._block_end:
+                        self._write_counter(self._next_number)
+            self._journal.close()
+            self._journal = None
+            self._file_lock.close()
+
+
+# Column names in the SQLite database for the booking columns, in ledger order
+_SQL_COLUMNS = {'Invoice Number': 'invoice_number', 'Name': 'name', 'Amount': 'amount', 'Date': 'date',
+                'Due Date': 'due_date', 'File Path': 'file_path', 'Address': 'address', 'City': 'city',
+                'Postal Code': 'postal_code', 'Country': 'country', 'Phone Number': 'phone_number',
+                'Hourly Rate': 'hourly_rate', 'Hours Booked': 'hours_booked', 'Status': 'status',
+                'Description': 'description'}
+_SQL_SELECT = ', '.join(_SQL_COLUMNS.values())
+
+_SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY,
+    invoice_number TEXT NOT NULL UNIQUE,
+    name TEXT,
+    amount NUMERIC,
+    date TEXT,
+    due_date TEXT,
+    file_path TEXT,
+    address TEXT,
+    city TEXT,
+    postal_code TEXT,
+    country TEXT,
+    phone_number TEXT,
+    hourly_rate NUMERIC,
+    hours_booked NUMERIC,
+    status TEXT,
+    description TEXT,
+    search_text TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS invoices_name ON invoices (name);
+CREATE INDEX IF NOT EXISTS invoices_status_due_date ON invoices (status, due_date);
+CREATE INDEX IF NOT EXISTS invoices_due_date ON invoices (due_date);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO counters (name, value)
+    SELECT 'invoice_number', COALESCE(MAX(CAST(SUBSTR(invoice_number, 2) AS INTEGER)), 0) + 1
+    FROM invoices WHERE invoice_number GLOB 's[0-9]*';
+"""
+
+
+def _sql_value(value):
+    # sqlite3 only binds plain Python values, not numpy scalars or NaN
+    if value is None or value != value:
+        return None
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    if isinstance(value, (str, bytes)):
+        return value
+    return str(value)
+
+
+def _day_string(day):
+    # The ISO date of a day number, which sorts the same way as the day numbers do
+    return (datetime(1970, 1, 1) + timedelta(days=day)).strftime("%Y-%m-%d")
+
+
+class SqliteBookingStorage(BookingStorage):
+    # Booking storage in an SQLite database, so the GUI and scripts can work on the same
+    # ledger at the same time. The database runs in WAL mode: readers never block the
+    # writer, and every write is a single transaction.
+    #
+    # Invoice number, name, status and due date are indexed, and lookups, totals, search,
+    # reminders and paging are answered by SQL instead of loading the ledger into memory.
+    # Search matches the same normalized text as InvoiceSearchIndex, stored with each row.
+    # Invoice numbers come from a counter table that is read and bumped in one write
+    # transaction, so concurrent writers never hand out the same number.
+    def __init__(self, database_file, fsync=True, timeout=30.0):
+        self.database_file = database_file
+        self.path = database_file
+        self._lock = threading.RLock()
+        self._aggregates = None  # LedgerAggregates, built on the first report
+        self._data_version = None  # PRAGMA data_version the aggregates were built at
+
+        self._connection = sqlite3.connect(database_file, timeout=timeout, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            for statement in _SQL_SCHEMA.split(';'):
+                if statement.strip():
+                    self._connection.execute(statement)
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return pd.DataFrame.from_records(rows, columns=list(_SQL_COLUMNS))
+
+    def _scalar(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchone()[0]
+
+    @property
+    def df(self):
+        return typed_ledger(self._query(f"SELECT {_SQL_SELECT} FROM invoices ORDER BY id"))
+
+    def __len__(self):
+        return self._scalar("SELECT COUNT(*) FROM invoices")
+
+    def __contains__(self, invoice_number):
+        return self._scalar("SELECT COUNT(*) FROM invoices WHERE invoice_number = ?", (invoice_number,)) > 0
+
+    def rows(self, start=None, stop=None):
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return self._query(f"SELECT {_SQL_SELECT} FROM invoices ORDER BY id LIMIT ? OFFSET ?",
+                           (max(0, stop - start), start))
+
+    def get(self, invoice_number):
+        invoice = self._query(f"SELECT {_SQL_SELECT} FROM invoices WHERE invoice_number = ?", (invoice_number,))
+        return invoice if len(invoice) else None
+
+    def total(self, status):
+        return float(self._scalar("SELECT COALESCE(SUM(amount), 0) FROM invoices WHERE status = ?", (status,)))
+
+    def search(self, query, prefix=False):
+        query = InvoiceSearchIndex.normalize(query.replace('\n', ' ')).strip()
+        if not query:
+            return self.rows()
+        if prefix:
+            query = ' ' + query
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return self._query(f"SELECT {_SQL_SELECT} FROM invoices WHERE search_text LIKE ? ESCAPE '\\' ORDER BY id",
+                           (pattern,))
+
+    @staticmethod
+    def _due_condition(start_day, end_day):
+        sql = "status = 'Outstanding' AND due_date IS NOT NULL"
+        parameters = []
+        if start_day is not None:
+            sql += " AND due_date >= ?"
+            parameters.append(_day_string(start_day))
+        if end_day is not None:
+            sql += " AND due_date < ?"
+            parameters.append(_day_string(end_day))
+        return sql, parameters
+
+    def due_between(self, start_day=None, end_day=None):
+        condition, parameters = self._due_condition(start_day, end_day)
+        return self._query(f"SELECT {_SQL_SELECT} FROM invoices WHERE {condition} ORDER BY due_date, id", parameters)
+
+    def iter_due_between(self, start_day=None, end_day=None, chunk_size=1000):
+        # Keyset pagination on (due_date, id), so every chunk is one short index range scan
+        condition, parameters = self._due_condition(start_day, end_day)
+        last = ('', 0)
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT {_SQL_SELECT}, id FROM invoices WHERE {condition} AND (due_date, id) > (?, ?) "
+                    f"ORDER BY due_date, id LIMIT ?", parameters + [*last, chunk_size]).fetchall()
+            if not rows:
+                return
+            last = (rows[-1][4], rows[-1][-1])
+            yield pd.DataFrame.from_records([row[:-1] for row in rows], columns=list(_SQL_COLUMNS))
+
+    def aging(self, today_day):
+        # One grouped query; each overdue invoice falls in the first bucket whose oldest
+        # due date it is on or after
+        cases = []
+        parameters = []
+        for label, min_days, max_days in AGING_BUCKETS:
+            if max_days is None:
+                cases.append("ELSE ?")
+                parameters.append(label)
+            else:
+                cases.append("WHEN due_date >= ? THEN ?")
+                parameters += [_day_string(today_day - max_days), label]
+        sql = (f"SELECT CASE {' '.join(cases)} END AS bucket, COUNT(*), COALESCE(SUM(amount), 0) FROM invoices "
+               f"WHERE status = 'Outstanding' AND due_date <= ? GROUP BY bucket")
+        parameters.append(_day_string(today_day - AGING_BUCKETS[0][1]))
+
+        report = {label: {'count': 0, 'amount': 0.0} for label, _, _ in AGING_BUCKETS}
+        with self._lock:
+            for label, count, amount in self._connection.execute(sql, parameters):
+                report[label] = {'count': count, 'amount': float(amount)}
+        return report
+
+    def _aggregates_from_sql(self):
+        # LedgerAggregates from two GROUP BY queries: one per customer, and one per invoice date
+        # and status whose few thousand groups are added up per month, ISO week and status
+        measures = ("COUNT(*), TOTAL(amount), TOTAL(CASE WHEN status = 'Paid' THEN amount END), "
+                    "TOTAL(CASE WHEN status = 'Outstanding' THEN amount END), TOTAL(hours_booked)")
+        aggregates = LedgerAggregates()
+        for name, *values in self._connection.execute(f"SELECT name, {measures} FROM invoices GROUP BY name"):
+            aggregates.add_measures({'customer': name}, values)
+        for date, status, *values in self._connection.execute(f"SELECT date, status, {measures} FROM invoices "
+                                                              f"GROUP BY date, status"):
+            aggregates.add_measures(LedgerAggregates._keys({'Date': date, 'Status': status}), values)
+        return aggregates
+
+    def rollup(self, dimension):
+        # The rollups follow this connection's own writes; data_version changes when another
+        # connection commits, and then they are queried again
+        with self._lock:
+            data_version = self._scalar("PRAGMA data_version")
+            if self._aggregates is None or data_version != self._data_version:
+                self._aggregates = self._aggregates_from_sql()
+                self._data_version = data_version
+            return self._aggregates.rollup(dimension)
+
+    def check_consistency(self):
+        with self._lock:
+            problems = [row[0] for row in self._connection.execute("PRAGMA integrity_check") if row[0] != 'ok']
+            if self._aggregates is not None and self._scalar("PRAGMA data_version") == self._data_version:
+                for dimension in self._aggregates.differences(LedgerAggregates(self.df)):
+                    problems.append(f"Rollup per {dimension} doesn't match the invoices.")
+            highest = self._scalar("SELECT MAX(CAST(SUBSTR(invoice_number, 2) AS INTEGER)) FROM invoices "
+                                   "WHERE invoice_number GLOB 's[0-9]*'")
+            next_number = self.next_invoice_number()
+            if highest is not None and next_number <= highest:
+                problems.append(f"Next invoice number {next_number} is not above the highest invoice s{highest}.")
+            return problems
+
+    def next_invoice_number(self):
+        return self._scalar("SELECT value FROM counters WHERE name = 'invoice_number'")
+
+    def reserve_invoice_numbers(self, count):
+        # BEGIN IMMEDIATE takes the database write lock before reading the counter, so no
+        # other connection can read the same value in between
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            first = max(1, self.next_invoice_number())
+            self._connection.execute("UPDATE counters SET value = ? WHERE name = 'invoice_number'", (first + count,))
+            return first
+
+    def append_invoices(self, rows):
+        if not rows:
+            return
+        records = [tuple(_sql_value(row.get(column)) for column in _SQL_COLUMNS) + (InvoiceSearchIndex.row_text(row),)
+                   for row in rows]
+        highest = max(_invoice_number_value(row.get('Invoice Number')) for row in rows)
+        with self._lock:
+            with metrics.stage('ledger_persist'), self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                cursor = self._connection.executemany(f"INSERT OR IGNORE INTO invoices ({_SQL_SELECT}, search_text) "
+                                                      f"VALUES ({', '.join('?' * (len(_SQL_COLUMNS) + 1))})", records)
+                # Keep the counter above invoice numbers that were assigned elsewhere
+                self._connection.execute("UPDATE counters SET value = MAX(value, ?) WHERE name = 'invoice_number'",
+                                         (highest + 1,))
+            if self._aggregates is not None:
+                if cursor.rowcount == len(rows):
+                    for row in rows:
+                        self._aggregates.add(row)
+                else:
+                    self._aggregates = None  # some invoices already existed
+        metrics.count('ledger_records_written', len(records))
+
+    def update_status(self, invoice_number, status):
+        with self._lock:
+            with metrics.stage('ledger_persist'), self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                old = self._connection.execute("SELECT name, amount, date, hours_booked, status FROM invoices "
+                                               "WHERE invoice_number = ?", (invoice_number,)).fetchone()
+                cursor = self._connection.execute("UPDATE invoices SET status = ? WHERE invoice_number = ?",
+                                                  (status, invoice_number))
+            if self._aggregates is not None and old is not None:
+                row = dict(zip(('Name', 'Amount', 'Date', 'Hours Booked'), old))
+                self._aggregates.change_status(row, old[4], status)
+        metrics.count('ledger_records_written', cursor.rowcount)
+        return cursor.rowcount > 0
+
+    def compact(self):
+        # Fold the write-ahead log back into the database file
+        with self._lock, metrics.stage('ledger_compact'):
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def open_booking_storage(booking_file):
+    # SQLite storage for .db/.sqlite/.sqlite3 files, the CSV ledger for anything else
+    if os.path.splitext(booking_file)[1].lower() in ('.db', '.sqlite', '.sqlite3'):
+        return SqliteBookingStorage(booking_file)
+    return BookingLedger(booking_file)
+
+
+def migrate_csv_to_sqlite(booking_file, database_file):
+    # Copy a CSV ledger (including its journal) into an SQLite database and return the number
+    # of invoices copied. Invoices already in the database are left alone, so running it
+    # twice is harmless.
+    ledger = BookingLedger(booking_file)
+    storage = SqliteBookingStorage(database_file)
+    try:
+        df = ledger.rows()
+        rows = df.astype(object).where(df.notna(), None).to_dict('records')
+        storage.append_invoices(rows)
+        return len(rows)
+    finally:
+        ledger.close()
+        storage.close()
+
+
+_CELL_PATTERN = '<c r="{}"(?P<attrs>[^>]*?)(?:/>|>(?P<body>.*?)</c>)'
+_CELL_TYPE_ATTR = re.compile(r'\s+t="[^"]*"')
+_CACHED_FORMULA_VALUE = re.compile(r'(<f[^>]*/>|<f[^>]*>[^<]*</f>)<v>[^<]*</v>')
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_SPREADSHEET_NS = {'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+                   'rel': 'http://schemas.openxmlformats.org/package/2006/relationships'}
+_RELATIONSHIP_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+
+class InvoiceTemplate:
+    # An invoice template parsed once and kept in memory.
+    #
+    # Invoices are rendered by splicing the new cell values straight into the XML of the
+    # active worksheet and zipping the result together with the untouched parts of the
+    # template, instead of loading and re-serializing the whole workbook with openpyxl.
+    def __init__(self, template_path):
+        self.template_path = template_path
+
+        with zipfile.ZipFile(template_path) as archive:
+            self._entries = [(info, archive.read(info)) for info in archive.infolist()]
+        self.parts = parts = {info.filename: data for info, data in self._entries}
+
+        self.workbook_name = 'xl/workbook.xml'
+        self.sheet_name = self._active_sheet_name(parts)
+
+        # Cached formula results would be stale after patching; drop them and let Excel
+        # recalculate on open, like openpyxl does
+        self._sheet_xml = _CACHED_FORMULA_VALUE.sub(r'\1', parts[self.sheet_name].decode('utf-8'))
+        workbook_xml = parts[self.workbook_name].decode('utf-8')
+        workbook_xml = re.sub(r'<calcPr\b[^>]*?/>', '<calcPr fullCalcOnLoad="1"/>', workbook_xml, count=1)
+        self._workbook_xml = workbook_xml.encode('utf-8')
+
+        self._layouts = {}
+        self._pdf_layout = None
+
+    def pdf_layout(self):
+        if self._pdf_layout is None:
+            self._pdf_layout = InvoicePdfLayout(self)
+        return self._pdf_layout
+
+    def _active_sheet_name(self, parts):
+        workbook = ET.fromstring(parts[self.workbook_name])
+        view = workbook.find('main:bookViews/main:workbookView', _SPREADSHEET_NS)
+        active_tab = int(view.get('activeTab', 0)) if view is not None else 0
+        sheet = workbook.findall('main:sheets/main:sheet', _SPREADSHEET_NS)[active_tab]
+
+        relationships = ET.fromstring(parts['xl/_rels/workbook.xml.rels'])
+        for relationship in relationships.findall('rel:Relationship', _SPREADSHEET_NS):
+            if relationship.get('Id') == sheet.get(_RELATIONSHIP_ID):
+                target = relationship.get('Target')
+                return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+        raise ValueError(f"Active sheet not found in template {self.template_path}.")
+
+    def _layout(self, cell_names):
+        # Split the sheet XML into the static text between the patched cells, once per set of cells
+        key = tuple(sorted(cell_names))
+        if key not in self._layouts:
+            matches = []
+            for cell in key:
+                match = re.search(_CELL_PATTERN.format(re.escape(cell)), self._sheet_xml)
+                if match is None:
+                    # Cells that don't exist in the sheet XML can't be patched in place
+                    self._layouts[key] = None
+                    return None
+                matches.append((match.start(), match.end(), cell, _CELL_TYPE_ATTR.sub('', match.group('attrs'))))
+            matches.sort()
+
+            chunks, slots, position = [], [], 0
+            for start, end, cell, attrs in matches:
+                chunks.append(self._sheet_xml[position:start])
+                slots.append((cell, attrs))
+                position = end
+            chunks.append(self._sheet_xml[position:])
+            self._layouts[key] = (chunks, slots)
+        return self._layouts[key]
+
+    def can_render(self, cells):
+        return self._layout(cells) is not None
+
+    def render_sheet(self, cells):
+        chunks, slots = self._layout(cells)
+        pieces = [chunks[0]]
+        for (cell, attrs), chunk in zip(slots, chunks[1:]):
+            pieces.append(_cell_xml(cell, attrs, cells[cell]))
+            pieces.append(chunk)
+        return ''.join(pieces).encode('utf-8')
+
+    def render(self, cells, output_path):
+        with metrics.stage('cell_fill'):
+            sheet_xml = self.render_sheet(cells)
+        with metrics.stage('workbook_save'), zipfile.ZipFile(output_path, 'w') as archive:
+            for info, data in self._entries:
+                if info.filename == self.sheet_name:
+                    data = sheet_xml
+                elif info.filename == self.workbook_name:
+                    data = self._workbook_xml
+                entry = zipfile.ZipInfo(info.filename, info.date_time)
+                entry.compress_type = info.compress_type
+                archive.writestr(entry, data)
+
+
+def _cell_xml(cell, attrs, value):
+    if value is None or value == '' or value != value:
+        return f'<c r="{cell}"{attrs}/>'
+    if isinstance(value, bool):
+        return f'<c r="{cell}"{attrs} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Integral):
+        return f'<c r="{cell}"{attrs}><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Real):
+        return f'<c r="{cell}"{attrs}><v>{float(value)!r}</v></c>'
+    text = _ILLEGAL_XML_CHARS.sub('', str(value)).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return f'<c r="{cell}"{attrs} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+_template_cache = {}
+
+
+def get_invoice_template(template_path):
+    # Parsed templates are cached per process by path and reloaded when the file changes
+    template_path = os.path.abspath(template_path)
+    mtime = os.stat(template_path).st_mtime_ns
+    cached = _template_cache.get(template_path)
+    if cached is None or cached[0] != mtime:
+        with metrics.stage('template_load'):
+            cached = (mtime, InvoiceTemplate(template_path))
+        _template_cache[template_path] = cached
+        metrics.count('templates_loaded')
+    return cached[1]
+
+
+def render_invoice_workbook(template_path, output_path, cells):
+    # Fill the given cells of the invoice template and save it as a new workbook
+    template = get_invoice_template(template_path)
+    if template.can_render(cells):
+        template.render(cells, output_path)
+    else:
+        render_invoice_workbook_openpyxl(template_path, output_path, cells)
+
+
+def render_invoice_workbook_openpyxl(template_path, output_path, cells):
+    with metrics.stage('template_load'):
+        wb_template = openpyxl.load_workbook(template_path)
+    try:
+        with metrics.stage('cell_fill'):
+            invoice_sheet = wb_template.active
+            for cell, value in cells.items():
+                invoice_sheet[cell].value = value
+        with metrics.stage('workbook_save'):
+            wb_template.save(output_path)
+    finally:
+        wb_template.close()  # Ensure workbook is closed after saving
+
+
+# Glyph widths of the standard Helvetica fonts for the characters 32-126, in 1/1000 em
+_HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556, 556, 556, 556,
+    556, 556, 556, 556, 278, 278, 584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667,
+    556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556, 333, 556,
+    556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556, 556, 556, 333, 500, 278, 556, 500, 722,
+    500, 500, 500, 334, 260, 334, 584)
+_HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556, 556, 556, 556,
+    556, 556, 556, 556, 333, 333, 584, 584, 584, 611, 975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722,
+    611, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556, 333, 556,
+    611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611, 611, 611, 389, 556, 333, 611, 556, 778,
+    556, 556, 500, 389, 280, 389, 584)
+_BORDER_WIDTHS = {'hair': 0.25, 'thin': 0.5, 'medium': 1.0, 'thick': 1.5, 'double': 1.5}
+_CELL_REFERENCE = re.compile(r'(\$?)([A-Z]{1,3})(\$?)(\d+)\b')
+_SIMPLE_FORMULA = re.compile(r'^\s*(SUM|PRODUCT)\((.*)\)\s*$', re.IGNORECASE)
+_EMU_PER_POINT = 12700
+
+
+def _split_cell(cell):
+    match = re.match(r'^([A-Z]+)(\d+)$', cell)
+    column = 0
+    for letter in match.group(1):
+        column = column * 26 + ord(letter) - 64
+    return column, int(match.group(2))
+
+
+def _column_letter(column):
+    letters = ''
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _text_width(text, size, bold):
+    widths = _HELVETICA_BOLD_WIDTHS if bold else _HELVETICA_WIDTHS
+    return sum(widths[ord(char) - 32] if 32 <= ord(char) <= 126 else 556 for char in text) * size / 1000
+
+
+def _pdf_string(text):
+    data = text.encode('cp1252', 'replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _pdf_color(rgb):
+    return ' '.join(f'{value:.3f}' for value in rgb)
+
+
+def _parse_color(element):
+    # Only explicit ARGB colors are supported; theme and indexed colors fall back to black
+    if element is not None and element.get('rgb'):
+        rgb = element.get('rgb')[-6:]
+        return tuple(int(rgb[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    return None
+
+
+def _format_number(value, format_code):
+    if not format_code or format_code == 'General':
+        return str(int(value)) if float(value).is_integer() else f'{value:.10g}'
+
+    format_code = format_code.split(';')[0]
+    format_code = re.sub(r'\[\$([^\]-]*)[^\]]*\]', r'\1', format_code)
+    format_code = format_code.replace('\\', '').replace('"', '')
+    pattern = re.search(r'[#0,]*0(\.0+)?', format_code)
+    if pattern is None:
+        return str(value)
+    decimals = len(pattern.group(1)) - 1 if pattern.group(1) else 0
+    thousands = ',' if ',' in pattern.group(0) else ''
+    number = f'{value:{thousands}.{decimals}f}'
+    return format_code[:pattern.start()] + number + format_code[pattern.end():]
+
+
+def _jpeg_info(data):
+    # Return (width, height, components) from the start-of-frame marker of a JPEG image
+    position = 2
+    while position < len(data) - 9:
+        if data[position] != 0xFF:
+            position += 1
+            continue
+        marker = data[position + 1]
+        length = int.from_bytes(data[position + 2:position + 4], 'big')
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[position + 5:position + 7], 'big')
+            width = int.from_bytes(data[position + 7:position + 9], 'big')
+            return width, height, data[position + 9]
+        position += 2 + length
+    return None
+
+
+class InvoicePdfLayout:
+    # The invoice template prepared for PDF output.
+    #
+    # Column widths, row heights, fills, borders, fonts and the logo are read from the template
+    # once. The page background and the text that is the same on every invoice are written to a
+    # shared content stream, so rendering an invoice only lays out the filled-in cells and the
+    # formulas depending on them. Text uses the standard Helvetica fonts, which need no embedding.
+    MARGIN = 36
+
+    def __init__(self, template):
+        self.template = template
+        parts = template.parts
+        sheet = ET.fromstring(parts[template.sheet_name])
+        ns = _SPREADSHEET_NS
+
+        self._read_styles(parts)
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in parts:
+            for item in ET.fromstring(parts['xl/sharedStrings.xml']).findall('main:si', ns):
+                shared_strings.append(''.join(text.text or '' for text in item.iter(f"{{{ns['main']}}}t")))
+
+        # Cell values, styles and formulas
+        self.cells = {}
+        row_heights = {}
+        shared_formulas = {}
+        for row in sheet.findall('main:sheetData/main:row', ns):
+            if row.get('ht'):
+                row_heights[int(row.get('r'))] = float(row.get('ht'))
+            for cell in row.findall('main:c', ns):
+                position = _split_cell(cell.get('r'))
+                value = cell.findtext('main:v', None, ns)
+                cell_type = cell.get('t', 'n')
+                if cell_type == 's' and value is not None:
+                    value = shared_strings[int(value)]
+                elif cell_type == 'inlineStr':
+                    value = ''.join(text.text or '' for text in cell.iter(f"{{{ns['main']}}}t"))
+                elif cell_type == 'b' and value is not None:
+                    value = value == '1'
+                elif cell_type == 'n' and value is not None:
+                    value = float(value)
+
+                formula = cell.find('main:f', ns)
+                formula_text = None
+                if formula is not None:
+                    formula_text = formula.text
+                    if formula.get('t') == 'shared':
+                        if formula_text:
+                            shared_formulas[formula.get('si')] = (position, formula_text)
+                        else:
+                            origin, master = shared_formulas.get(formula.get('si'), (position, ''))
+                            formula_text = _CELL_REFERENCE.sub(
+                                lambda match: self._shift_reference(match, position[0] - origin[0], position[1] - origin[1]),
+                                master)
+
+                self.cells[position] = {'style': int(cell.get('s', 0)), 'value': value, 'formula': formula_text}
+
+        # Column and row geometry in points
+        format_properties = sheet.find('main:sheetFormatPr', ns)
+        default_width = float(format_properties.get('defaultColWidth', 8.43)) if format_properties is not None else 8.43
+        default_height = float(format_properties.get('defaultRowHeight', 15)) if format_properties is not None else 15
+        column_widths = {}
+        for column in sheet.findall('main:cols/main:col', ns):
+            for index in range(int(column.get('min')), int(column.get('max')) + 1):
+                column_widths[index] = float(column.get('width', default_width))
+
+        self.merged = {}
+        for merge in sheet.findall('main:mergeCells/main:mergeCell', ns):
+            start, end = merge.get('ref').split(':')
+            self.merged[_split_cell(start)] = _split_cell(end)
+
+        used = [position for position, cell in self.cells.items()
+                if cell['value'] not in (None, '') or cell['formula'] or self._is_decorated(cell['style'])]
+        self.last_column = max([position[0] for position in used] + list(column_widths) + [1])
+        self.last_row = max([position[1] for position in used] + [1])
+
+        self.column_x = [0.0, 0.0]
+        for index in range(1, self.last_column + 1):
+            self.column_x.append(self.column_x[-1] + (column_widths.get(index, default_width) * 7 + 5) * 0.75)
+        self.row_y = [0.0, 0.0]
+        for index in range(1, self.last_row + 1):
+            self.row_y.append(self.row_y[-1] + row_heights.get(index, default_height))
+
+        self._read_image(parts, sheet)
+
+        # Scale the used range down to fit the page, like fitToPage does when printing
+        self.page_width, self.page_height = 595.28, 841.89
+        self.scale = min(1.0, (self.page_width - 2 * self.MARGIN) / self.column_x[-1],
+                         (self.page_height - 2 * self.MARGIN) / max(self.row_y[-1], self.image_bottom))
+
+        self._resources = self._build_resources()
+        self._static_streams = {}
+
+    @staticmethod
+    def _shift_reference(match, columns, rows):
+        column_fixed, letters, row_fixed, row = match.groups()
+        column = _split_cell(letters + '1')[0]
+        column = column if column_fixed else column + columns
+        row = int(row) if row_fixed else int(row) + rows
+        return f'{column_fixed}{_column_letter(column)}{row_fixed}{row}'
+
+    def _read_styles(self, parts):
+        ns = _SPREADSHEET_NS
+        styles = ET.fromstring(parts['xl/styles.xml'])
+
+        self.number_formats = {int(item.get('numFmtId')): item.get('formatCode')
+                               for item in styles.findall('main:numFmts/main:numFmt', ns)}
+        self.number_formats.update({2: '0.00', 3: '#,##0', 4: '#,##0.00'})
+
+        self.fonts = []
+        for font in styles.findall('main:fonts/main:font', ns):
+            size = font.find('main:sz', ns)
+            self.fonts.append({'size': float(size.get('val')) if size is not None else 11.0,
+                               'bold': font.find('main:b', ns) is not None,
+                               'color': _parse_color(font.find('main:color', ns)) or (0, 0, 0)})
+
+        self.fills = []
+        for fill in styles.findall('main:fills/main:fill', ns):
+            pattern = fill.find('main:patternFill', ns)
+            color = None
+            if pattern is not None and pattern.get('patternType') == 'solid':
+                color = _parse_color(pattern.find('main:fgColor', ns))
+            self.fills.append(color)
+
+        self.borders = []
+        for border in styles.findall('main:borders/main:border', ns):
+            sides = {}
+            for side in ('left', 'right', 'top', 'bottom'):
+                element = border.find(f'main:{side}', ns)
+                if element is not None and element.get('style') in _BORDER_WIDTHS:
+                    sides[side] = (_BORDER_WIDTHS[element.get('style')],
+                                   _parse_color(element.find('main:color', ns)) or (0, 0, 0))
+            self.borders.append(sides)
+
+        self.styles = []
+        for xf in styles.findall('main:cellXfs/main:xf', ns):
+            alignment = xf.find('main:alignment', ns)
+            self.styles.append({
+                'font': self.fonts[int(xf.get('fontId', 0))],
+                'fill': self.fills[int(xf.get('fillId', 0))],
+                'border': self.borders[int(xf.get('borderId', 0))],
+                'number_format': self.number_formats.get(int(xf.get('numFmtId', 0))),
+                'horizontal': alignment.get('horizontal') if alignment is not None else None,
+                'vertical': alignment.get('vertical', 'bottom') if alignment is not None else 'bottom',
+                'wrap': alignment is not None and alignment.get('wrapText') == '1',
+            })
+
+    def _is_decorated(self, style):
+        return bool(self.styles[style]['fill'] or self.styles[style]['border'])
+
+    def _read_image(self, parts, sheet):
+        # Only the first JPEG picture of the sheet is carried over, which covers a company logo
+        self.image = None
+        self.image_bottom = 0.0
+        drawing = sheet.find('main:drawing', _SPREADSHEET_NS)
+        if drawing is None:
+            return
+        sheet_directory = os.path.dirname(self.template.sheet_name)
+        sheet_rels = parts.get(f'{sheet_directory}/_rels/{os.path.basename(self.template.sheet_name)}.rels')
+        if sheet_rels is None:
+            return
+        targets = {item.get('Id'): item.get('Target') for item in ET.fromstring(sheet_rels)}
+        drawing_name = os.path.normpath(os.path.join(sheet_directory, targets.get(drawing.get(_RELATIONSHIP_ID), ''))).replace(os.sep, '/')
+        if drawing_name not in parts:
+            return
+        drawing_rels = parts.get(f'{os.path.dirname(drawing_name)}/_rels/{os.path.basename(drawing_name)}.rels')
+        image_targets = {item.get('Id'): item.get('Target') for item in ET.fromstring(drawing_rels)} if drawing_rels else {}
+
+        xdr = '{http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing}'
+        blip = '{http://schemas.openxmlformats.org/drawingml/2006/main}blip'
+        embed = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed'
+        for anchor in ET.fromstring(parts[drawing_name]):
+            picture_blip = next(anchor.iter(blip), None)
+            start = anchor.find(f'{xdr}from')
+            if picture_blip is None or start is None:
+                continue
+            image_name = os.path.normpath(os.path.join(os.path.dirname(drawing_name), image_targets.get(picture_blip.get(embed), ''))).replace(os.sep, '/')
+            data = parts.get(image_name)
+            info = _jpeg_info(data) if data and image_name.lower().endswith(('.jpg', '.jpeg')) else None
+            if info is None or info[2] not in (1, 3):
+                continue
+
+            column = int(start.findtext(f'{xdr}col')) + 1
+            row = int(start.findtext(f'{xdr}row')) + 1
+            x = self.column_x[min(column, len(self.column_x) - 1)] + int(start.findtext(f'{xdr}colOff')) / _EMU_PER_POINT
+            y = self.row_y[min(row, len(self.row_y) - 1)] + int(start.findtext(f'{xdr}rowOff')) / _EMU_PER_POINT
+            extent = anchor.find(f'{xdr}ext')
+            if extent is not None:
+                width = int(extent.get('cx')) / _EMU_PER_POINT
+                height = int(extent.get('cy')) / _EMU_PER_POINT
+            else:
+                end = anchor.find(f'{xdr}to')
+                width = self.column_x[int(end.findtext(f'{xdr}col')) + 1] + int(end.findtext(f'{xdr}colOff')) / _EMU_PER_POINT - x
+                height = self.row_y[int(end.findtext(f'{xdr}row')) + 1] + int(end.findtext(f'{xdr}rowOff')) / _EMU_PER_POINT - y
+            self.image = {'data': data, 'pixels': info, 'box': (x, y, width, height)}
+            self.image_bottom = y + height
+            return
+
+    def _box(self, position):
+        # Page rectangle (x, y, width, height) of a cell or merged range, y measured from the bottom
+        column, row = position
+        last_column, last_row = self.merged.get(position, position)
+        last_column = min(last_column, self.last_column)
+        last_row = min(last_row, self.last_row)
+        x = self.MARGIN + self.column_x[column] * self.scale
+        width = (self.column_x[last_column + 1] - self.column_x[column]) * self.scale
+        height = (self.row_y[last_row + 1] - self.row_y[row]) * self.scale
+        y = self.page_height - self.MARGIN - self.row_y[last_row + 1] * self.scale
+        return x, y, width, height
+
+    def _display_value(self, value, style):
+        if value is None or value == '' or value != value:
+            return ''
+        if isinstance(value, bool):
+            return 'TRUE' if value else 'FALSE'
+        if isinstance(value, numbers.Real):
+            return _format_number(float(value), style['number_format'])
+        return ' '.join(str(value).split())
+
+    def _text(self, position, value, style_index):
+        style = self.styles[style_index]
+        text = self._display_value(value, style)
+        if not text:
+            return b''
+        font = style['font']
+        size = font['size'] * self.scale
+        x, y, width, height = self._box(position)
+        # Wrapping cells keep their text inside the cell; long text is cut off at the border
+        clip = f'q {x:.2f} {y:.2f} {width:.2f} {height:.2f} re W n ' if style['wrap'] else ''
+
+        horizontal = style['horizontal'] or ('right' if isinstance(value, numbers.Real) and not isinstance(value, bool) else 'left')
+        padding = 2 * self.scale
+        if horizontal == 'right':
+            x = x + width - padding - _text_width(text, size, font['bold'])
+        elif horizontal in ('center', 'centerContinuous'):
+            x = x + (width - _text_width(text, size, font['bold'])) / 2
+        else:
+            x = x + padding
+
+        if style['vertical'] == 'top':
+            y = y + height - size
+        elif style['vertical'] == 'center':
+            y = y + (height - size * 0.7) / 2
+        else:
+            y = y + size * 0.25
+
+        font_name = '/F2' if font['bold'] else '/F1'
+        return (f'{clip}BT {font_name} {size:.2f} Tf {_pdf_color(font["color"])} rg {x:.2f} {y:.2f} Td '.encode('ascii')
+                + _pdf_string(text) + (b' Tj ET Q\n' if clip else b' Tj ET\n'))
+
+    def _background(self):
+        commands = []
+        for position, cell in sorted(self.cells.items(), key=lambda item: (item[0][1], item[0][0])):
+            if position[0] > self.last_column or position[1] > self.last_row:
+                continue
+            style = self.styles[cell['style']]
+            x, y, width, height = self._box(position)
+            if style['fill']:
+                commands.append(f'{_pdf_color(style["fill"])} rg {x:.2f} {y:.2f} {width:.2f} {height:.2f} re f')
+            for side, (line_width, color) in style['border'].items():
+                start, end = {'left': ((x, y), (x, y + height)), 'right': ((x + width, y), (x + width, y + height)),
+                              'top': ((x, y + height), (x + width, y + height)), 'bottom': ((x, y), (x + width, y))}[side]
+                commands.append(f'{_pdf_color(color)} RG {line_width * self.scale:.2f} w '
+                                f'{start[0]:.2f} {start[1]:.2f} m {end[0]:.2f} {end[1]:.2f} l S')
+
+        if self.image is not None:
+            x, y, width, height = self.image['box']
+            commands.append(f'q {width * self.scale:.2f} 0 0 {height * self.scale:.2f} {self.MARGIN + x * self.scale:.2f} '
+                            f'{self.page_height - self.MARGIN - (y + height) * self.scale:.2f} cm /Im1 Do Q')
+        return ('\n'.join(commands) + '\n').encode('ascii')
+
+    def _build_resources(self):
+        # Font and image objects are identical for every invoice and serialized only once
+        fonts = [b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+                 b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>']
+        objects = fonts
+        if self.image is not None:
+            width, height, components = self.image['pixels']
+            color_space = '/DeviceRGB' if components == 3 else '/DeviceGray'
+            objects = fonts + [(f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace {color_space} '
+                                f'/BitsPerComponent 8 /Filter /DCTDecode /Length {len(self.image["data"])} >>\nstream\n').encode('ascii')
+                               + self.image['data'] + b'\nendstream']
+        return objects
+
+    def _static_stream(self, dynamic_cells):
+        # Everything that doesn't depend on the filled-in cells, compressed once per set of cells
+        key = frozenset(dynamic_cells)
+        if key not in self._static_streams:
+            content = [self._background()]
+            for position, cell in sorted(self.cells.items(), key=lambda item: (item[0][1], item[0][0])):
+                if _column_letter(position[0]) + str(position[1]) in key or cell['formula']:
+                    continue
+                if position[0] <= self.last_column and position[1] <= self.last_row:
+                    content.append(self._text(position, cell['value'], cell['style']))
+            self._static_streams[key] = _pdf_stream(b''.join(content))
+        return self._static_streams[key]
+
+    def _evaluate(self, position, values, seen=()):
+        # SUM and PRODUCT over cell references are evaluated the way Excel does: text is ignored.
+        # Other formulas keep the result cached in the template.
+        cell = self.cells.get(position)
+        if cell is None:
+            return None
+        if not cell['formula']:
+            return values.get(position, cell['value'])
+        match = _SIMPLE_FORMULA.match(cell['formula'])
+        if match is None or position in seen:
+            return cell['value']
+
+        operands = []
+        for argument in match.group(2).split(','):
+            argument = argument.strip().replace('$', '')
+            if ':' in argument:
+                (first_column, first_row), (last_column, last_row) = (_split_cell(part) for part in argument.split(':'))
+                references = [(column, row) for row in range(first_row, last_row + 1)
+                              for column in range(first_column, last_column + 1)]
+            elif re.match(r'^[A-Z]+\d+$', argument):
+                references = [_split_cell(argument)]
+            else:
+                try:
+                    operands.append(float(argument))
+                except ValueError:
+                    return cell['value']
+                continue
+            for reference in references:
+                value = self._evaluate(reference, values, seen + (position,))
+                if isinstance(value, numbers.Real) and not isinstance(value, bool) and value == value:
+                    operands.append(float(value))
+
+        if match.group(1).upper() == 'SUM':
+            return sum(operands)
+        product = 1.0 if operands else 0.0
+        for operand in operands:
+            product *= operand
+        return product
+
+    def render(self, cells):
+        values = {_split_cell(cell): value for cell, value in cells.items()}
+        dynamic = [self._text(position, value, self.cells[position]['style'] if position in self.cells else 0)
+                   for position, value in values.items()]
+        for position, cell in self.cells.items():
+            if cell['formula'] and position[0] <= self.last_column and position[1] <= self.last_row:
+                dynamic.append(self._text(position, self._evaluate(position, values), cell['style']))
+
+        resources = '/Font << /F1 5 0 R /F2 6 0 R >>' + (' /XObject << /Im1 7 0 R >>' if self.image is not None else '')
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.page_width} {self.page_height}] '
+             f'/Resources << {resources} >> /Contents [4 0 R 8 0 R] >>').encode('ascii'),
+            self._static_stream(cells),
+        ] + self._resources
+        if self.image is None:
+            objects.append(b'null')
+        objects.append(_pdf_stream(b''.join(dynamic)))
+        return _pdf_document(objects)
+
+
+def _pdf_stream(content):
+    data = zlib.compress(content)
+    return b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(data) + data + b'\nendstream'
+
+
+def _pdf_document(objects):
+    output = [b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n']
+    offsets = []
+    length = len(output[0])
+    for number, body in enumerate(objects, start=1):
+        chunk = b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        offsets.append(length)
+        output.append(chunk)
+        length += len(chunk)
+
+    output.append(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    output.extend(b'%010d 00000 n \n' % offset for offset in offsets)
+    output.append(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, length))
+    return b''.join(output)
+
+
+def render_invoice_pdf(template_path, output_path, cells):
+    # Render the invoice straight to PDF; the layout is built once per template and process
+    template = get_invoice_template(template_path)
+    with metrics.stage('pdf_render'):
+        pdf = template.pdf_layout().render(cells)
+        with open(output_path, 'wb') as output:
+            output.write(pdf)
+
+
+def _render_invoice_job(job):
+    # Process pool entry point; errors are returned so one bad invoice doesn't stop the batch.
+    # The render time is returned as well, since the stages timed inside a worker process
+    # stay in that process's metrics.
+    index, template_path, output_path, cells, pdf = job
+    start = time.perf_counter()
+    try:
+        render_invoice_workbook(template_path, output_path, cells)
+        if pdf:
+            render_invoice_pdf(template_path, os.path.splitext(output_path)[0] + '.pdf', cells)
+    except Exception as e:
+        return index, e, time.perf_counter() - start
+    return index, None, time.perf_counter() - start
+
+
+class BulkInvoiceResult:
+    # Outcome of InvoiceManager.create_invoices_bulk: the paths of the created invoices,
+    # {index: (invoice number, path)} of the created records and (index, record, error) for
+    # every record that failed
+    def __init__(self, total):
+        self.total = total
+        self.created = []
+        self.invoices = {}
+        self.failed = []
+
+    @property
+    def done(self):
+        return len(self.created) + len(self.failed)
+
+    def report(self, progress):
+        if progress is not None:
+            progress(self.done, self.total)
+
+    def __repr__(self):
+        return f"BulkInvoiceResult(created={len(self.created)}, failed={len(self.failed)}, total={self.total})"
+
+
+class InvoiceManager:
+    # booking_file is a CSV ledger or, for .db/.sqlite/.sqlite3 files, an SQLite database;
+    # pass storage to use any other BookingStorage. Invoices are saved in output_dir, next to
+    # this script by default.
+    def __init__(self, template_path, booking_file, storage=None, output_dir=None):
+        self.template_path = template_path
+        self.booking_file = booking_file
+        self.output_dir = output_dir or os.path.dirname(os.path.abspath(__file__))
+        
+        if not os.path.exists(template_path):
+            raise FileNotFoundError(f"Template file {template_path} not found.")
+        
+        self._wb_template = None
+
+        self.ledger = storage if storage is not None else open_booking_storage(booking_file)
+
+    @property
+    def wb_template(self):
+        # Invoices are rendered from the cached template XML; the openpyxl workbook is only
+        # loaded if something asks for it
+        if self._wb_template is None:
+            with metrics.stage('template_load'):
+                self._wb_template = openpyxl.load_workbook(self.template_path, keep_links=False)
+        return self._wb_template
+
+    @property
+    def template_sheet(self):
+        return self.wb_template.active
+
+    @property
+    def df_booking(self):
+        return self.ledger.df
+
+    @property
+    def next_invoice_number(self):
+        return self.ledger.next_invoice_number()
+
+    def export_csv(self, path):
+        self.ledger.export_csv(path)
+
+    def compact(self):
+        self.ledger.compact()
+
+    def archive(self, before=None):
+        # Move paid invoices dated before `before` (default: before last year) from the
+        # booking CSV to the yearly archive; returns how many were moved
+        return self.ledger.archive(None if before is None else _day_number(before))
+
+    def close(self):
+        self.ledger.close()
+
+    def get_metrics(self):
+        # Stage timings and counters of this process, see Metrics.snapshot
+        return metrics.snapshot()
+
+
+    def _reserve_invoice_numbers(self, count):
+        # Hand out a contiguous block of invoice numbers and return the first one
+        return self.ledger.reserve_invoice_numbers(count)
+
+    def _prepare_invoice(self, invoice_number, name, amount=None, date=None, due_date=None, hours=None, hourly_rate=None,
+                         total=None, address=None, city=None, postal_code=None, country=None, phone_number=None,
+                         description=None):
+        # Work out the cell values for the invoice sheet and the matching booking row
+        for argument, value in (('amount', amount), ('hours', hours), ('hourly_rate', hourly_rate), ('total', total)):
+            if value is not None and not isinstance(value, numbers.Number):
+                raise ValueError(f"{argument} must be a number, not {value!r}")
+        if not isinstance(date, datetime):
+            date = datetime.strptime(date, "%Y-%m-%d")
+
+        # Calculate amount based on provided data
+        if hours is not None and hourly_rate is not None:
+            amount = int(hours * hourly_rate)
+        elif total is not None:
+            amount = int(total)
+
+        # Calculate due date for invoice
+        due_date = date + timedelta(days=14)
+
+        invoice_number_str = f's{invoice_number}'
+        invoice_filename = f'invoice_{invoice_number_str}_{name}.xlsx'
+        full_invoice_path = os.path.join(self.output_dir, invoice_filename)
+
+        cells = {
+            'B22': description,
+            'F12': invoice_number_str,
+            'C22': date.strftime("%Y-%m-%d"),
+            'B9': date.strftime("%Y-%m-%d"),
+            'D22': str(date.isocalendar()[1]),
+            'E22': hours if hours is not None else '',
+            'F22': f'€ {hourly_rate:,.2f}' if hourly_rate is not None else '',
+            'B12': name,
+            'B13': address if address else '',
+            'B14': city if city else '',
+            'B15': f'{postal_code}, {country}' if postal_code and country else '',
+            'B16': phone_number if phone_number else '',
+            'F17': due_date.strftime("%Y-%m-%d"),
+        }
+
+        booking_row = {
+            'Invoice Number': invoice_number_str,
+            'Name': name,
+            'Description': description,
+            'Amount': amount,
+            'Date': date.strftime("%Y-%m-%d"),
+            'Due Date': due_date.strftime("%Y-%m-%d"),
+            'File Path': full_invoice_path,
+            'Address': address,
+            'City': city,
+            'Postal Code': postal_code,
+            'Country': country,
+            'Phone Number': phone_number,
+            'Hourly Rate': hourly_rate if hourly_rate is not None else 0,
+            'Hours Booked': hours if hours is not None else 0,
+            'Status': 'Outstanding'
+        }
+        return cells, booking_row
+
+    def create_invoice(self, name, amount, date, due_date=None, hours=None, hourly_rate=None, total=None,
+                       address=None, city=None, postal_code=None, country=None, phone_number=None, description=None,
+                       pdf=False):
+        try:
+            with metrics.stage('create_invoice'):
+                # Generate invoice number
+                invoice_number = self._reserve_invoice_numbers(1)
+                logger.debug("Generated invoice number: s%s", invoice_number)
+
+                cells, new_invoice = self._prepare_invoice(invoice_number, name, amount, date, due_date, hours,
+                                                           hourly_rate, total, address, city, postal_code, country,
+                                                           phone_number, description)
+                logger.debug("Calculated amount: %s", new_invoice['Amount'])
+
+                # Save the invoice to a file
+                full_invoice_path = new_invoice['File Path']
+                try:
+                    render_invoice_workbook(self.template_path, full_invoice_path, cells)
+                except PermissionError as pe:
+                    logger.error("Permission error: Unable to save the file. Please check if you have write access to %s",
+                                 full_invoice_path)
+                    raise pe
+                except Exception as save_error:
+                    logger.error("Error saving the file: %s", save_error)
+                    raise save_error
+
+                # Save as PDF in the same folder
+                if pdf:
+                    full_pdf_path = os.path.splitext(full_invoice_path)[0] + '.pdf'
+                    render_invoice_pdf(self.template_path, full_pdf_path, cells)
+                    logger.debug("Saved invoice PDF to %s", full_pdf_path)
+
+                # Record the new invoice in the booking ledger
+                with metrics.stage('ledger_append'):
+                    self.ledger.append_invoice(new_invoice)
+
+            metrics.count('invoices_created')
+            logger.debug("Created invoice %s in %s", new_invoice['Invoice Number'], full_invoice_path)
+            return full_invoice_path
+
+        except Exception as e:
+            metrics.count('invoices_failed')
+            logger.error("Error occurred while creating invoice: %s", e)
+            raise e
+
+    def create_invoices_bulk(self, records, max_workers=None, progress=None, pdf=False, executor=None):
+        # Create many invoices at once. records is an iterable of dicts (or a DataFrame) with the
+        # keyword arguments of create_invoice. The invoice numbers are reserved up front, the
+        # workbooks are rendered in a process pool and all booking rows are written in one go.
+        # A failing record is reported in the result instead of aborting the batch; its
+        # invoice number is skipped. With pdf=True every invoice is also saved as PDF, reusing
+        # the PDF layout of the template within each worker process. A long-running caller can
+        # pass its own ProcessPoolExecutor as executor; it is reused and left running.
+        start = time.perf_counter()
+        if 'pandas' in sys.modules and isinstance(records, pd.DataFrame):
+            records = records.astype(object).where(records.notna(), None).to_dict('records')
+        else:
+            records = list(records)
+
+        result = BulkInvoiceResult(len(records))
+        first_number = self._reserve_invoice_numbers(len(records))
+
+        jobs = []
+        booking_rows = {}
+        for index, record in enumerate(records):
+            try:
+                cells, booking_row = self._prepare_invoice(first_number + index, **record)
+            except Exception as e:
+                result.failed.append((index, record, e))
+                result.report(progress)
+                continue
+            booking_rows[index] = booking_row
+            jobs.append((index, self.template_path, booking_row['File Path'], cells, pdf))
+
+        own_executor = None
+        if max_workers == 1 or len(jobs) <= 1:
+            rendered = map(_render_invoice_job, jobs)
+        else:
+            workers = max_workers or os.cpu_count() or 1
+            if executor is None:
+                executor = own_executor = ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, len(jobs) // (4 * workers))
+            rendered = executor.map(_render_invoice_job, jobs, chunksize=chunksize)
+
+        try:
+            for index, error, duration in rendered:
+                metrics.record('invoice_render', duration)
+                if error is None:
+                    result.created.append(booking_rows[index]['File Path'])
+                    result.invoices[index] = (booking_rows[index]['Invoice Number'], booking_rows[index]['File Path'])
+                else:
+                    result.failed.append((index, records[index], error))
+                    del booking_rows[index]
+                result.report(progress)
+        finally:
+            if own_executor is not None:
+                own_executor.shutdown()
+
+        with metrics.stage('ledger_append'):
+            self.ledger.append_invoices([booking_rows[index] for index in sorted(booking_rows)])
+        metrics.count('invoices_created', len(result.created))
+        metrics.count('invoices_failed', len(result.failed))
+        metrics.record('create_invoices_bulk', time.perf_counter() - start)
+        logger.debug("Created %d of %d invoices", len(result.created), result.total)
+        return result
+
+
+    def send_reminders(self, today=None, horizons=(7,)):
+        return list(self.iter_reminders(today, horizons))
+
+    def iter_reminders(self, today=None, horizons=(7,), chunk_size=1000):
+        # Reminder messages for outstanding invoices that are overdue or due exactly one of the
+        # horizons (in days) from today. Messages are generated lazily, chunk by chunk, so a
+        # scheduled job can stream them for any ledger size.
+        today_day = _day_number(today or datetime.today())
+
+        for chunk in self.ledger.iter_due_between(None, today_day, chunk_size):
+            for invoice_number, name in zip(chunk['Invoice Number'], chunk['Name']):
+                yield f"Reminder: Invoice {invoice_number} is overdue! Please contact {name}."
+
+        for days in horizons:
+            for chunk in self.ledger.iter_due_between(today_day + days, today_day + days + 1, chunk_size):
+                for invoice_number, name in zip(chunk['Invoice Number'], chunk['Name']):
+                    yield f"Reminder: Invoice {invoice_number} is due in {days} days. Please contact {name}."
+
+    def get_overdue_invoices(self, today=None):
+        return self.ledger.due_between(None, _day_number(today or datetime.today()))
+
+    def get_invoices_due_within(self, days, today=None):
+        # Outstanding invoices due between today and today + days, inclusive
+        today_day = _day_number(today or datetime.today())
+        return self.ledger.due_between(today_day, today_day + days + 1)
+
+    def get_aging_report(self, today=None):
+        # {bucket: {'count': ..., 'amount': ...}} for outstanding invoices by days overdue
+        return self.ledger.aging(_day_number(today or datetime.today()))
+
+    def get_report(self, today=None):
+        # Summary of the ledger for the command line and the HTTP service
+        return {
+            'invoices': self.count_invoices(),
+            'total_received': self.get_total_received(),
+            'total_outstanding': self.get_total_outstanding(),
+            'aging': self.get_aging_report(today),
+        }
+
+    def get_rollup(self, dimension):
+        # DataFrame with the number of invoices, the amount invoiced, received and outstanding
+        # and the hours billed per 'customer', 'month', 'week' (ISO week) or 'status'
+        return self.ledger.rollup(dimension)
+
+    def get_dashboard(self, today=None, months=12, customers=5):
+        # What the GUI dashboard shows: totals, hours billed and aging, the last months and
+        # the customers with the most invoiced
+        by_status = self.get_rollup('status')
+        return {
+            'total_received': self.get_total_received(),
+            'total_outstanding': self.get_total_outstanding(),
+            'hours_billed': float(by_status['hours'].sum()),
+            'aging': self.get_aging_report(today),
+            'months': self.get_rollup('month').tail(months),
+            'customers': self.get_rollup('customer').nlargest(customers, 'invoiced'),
+        }
+
+    def get_invoices(self, start=None, stop=None):
+        # Slice before selecting the columns so a page of the list doesn't copy the whole ledger
+        return self.ledger.rows(start, stop)[['Invoice Number', 'Name', 'Amount', 'Date', 'Due Date', 'Status']]
+
+    def count_invoices(self):
+        return len(self.ledger)
+
+    def set_cell_value(self, sheet, cell, value):
+        try:
+            logger.debug("Setting cell %s with cell type %s with value: %s", cell, type(cell), value)
+
+            if isinstance(cell, str):
+                cell = sheet[cell]
+                logger.debug("Cell coordinates resolved: %s", cell.coordinate)
+
+            merged_range = None
+            for range_coord in sheet.merged_cells.ranges:
+                if cell.coordinate in range_coord:
+                    merged_range = range_coord
+                    logger.debug("Found merged range: %s", merged_range)
+                    break
+
+            if merged_range:
+                logger.debug("Unmerging cells in range: %s", merged_range)
+                sheet.unmerge_cells(merged_range)
+                sheet[cell.coordinate] = value  # Set value directly without merging
+                logger.debug("Set cell %s with value %s", cell, value)
+            else:
+                if isinstance(value, (int, float)):
+                    logger.debug("Setting numeric value: %s", value)
+                    cell.value = value  # Set numeric value directly
+                else:
+                    logger.debug("Setting string value: %s", value)
+                    cell.value = str(value)  # Convert non-numeric values to string
+
+        except Exception as e:
+            logger.error("Error occurred while setting cell %s with value %s: %s", cell, value, e)
+            # Optionally, raise the error again to propagate it up or handle it as needed
+            raise e
+
+
+    def get_total_received(self):
+        return self.ledger.total('Paid')
+
+    def get_total_outstanding(self):
+        return self.ledger.total('Outstanding')
+
+    def update_invoice_status(self, invoice_number, status):
+        return self.ledger.update_status(invoice_number, status)
+
+    def search_invoices(self, query, prefix=False):
+        # Matches name, city, invoice number and description, ignoring case and accents
+        return self.ledger.search(query, prefix)
+
+    def get_invoice_details(self, invoice_number):
+        invoice = self.ledger.get(invoice_number)
+        if invoice is None:
+            invoice = self.ledger.rows(0, 0)
+        invoice_details = invoice.to_string(index=False)
+        return invoice_details
+
+    def check_consistency(self):
+        return self.ledger.check_consistency()
+
+class InvoiceService:
+    # Local HTTP/JSON front end for one long-lived InvoiceManager, so the template cache and
+    # the ledger stay loaded between requests. Runs on asyncio without any display.
+    #
+    #   POST /invoices               create one invoice (create_invoice arguments as JSON)
+    #   POST /invoices/bulk          create a list of invoices in one batch
+    #   GET  /invoices/<number>      booking row of one invoice
+    #   POST /invoices/<number>/paid mark an invoice as paid
+    #   GET  /report                 totals, counts and aging
+    #   GET  /report/<dimension>     invoices, amounts and hours per customer, month, week or status
+    #   GET  /metrics                stage timings and counters (Metrics.snapshot)
+    #   GET  /health
+    #
+    # Concurrent create requests are group-committed: while one batch is being rendered and
+    # written, new requests queue up, and the next batch takes all of them (up to max_batch)
+    # through create_invoices_bulk in a single ledger write. Manager calls run one at a time
+    # on a worker thread, so the event loop keeps accepting requests. Big batches render in a
+    # process pool that is started once with the service and reused for every batch.
+    def __init__(self, manager, max_batch=500, parallel_batch=32):
+        self.manager = manager
+        self.max_batch = max_batch
+        self.parallel_batch = parallel_batch  # batches at least this big render in worker processes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='invoice-service')
+        self._render_pool = None
+        self._queue = None
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        self._queue = asyncio.Queue()
+        self._render_pool = self._start_render_pool()
+        batcher = asyncio.create_task(self._batch_creates())
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info("Serving invoices on http://%s:%s", host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.close()
+
+    def _start_render_pool(self):
+        # Spawned instead of forked: a forked worker would inherit the open client connections
+        # and keep them from closing
+        return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn'))
+
+    def close(self):
+        self._executor.shutdown()
+        if self._render_pool is not None:
+            self._render_pool.shutdown()
+            self._render_pool = None
+
+    async def _call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def create(self, record):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future))
+        return await future
+
+    async def _batch_creates(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(0)  # let requests that arrived together queue up
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            for pdf in (False, True):
+                items = [(record, future) for record, future in batch if bool(record.get('pdf')) == pdf]
+                if items:
+                    await self._commit(items, pdf)
+
+    async def _commit(self, items, pdf):
+        records = [{key: value for key, value in record.items() if key != 'pdf'} for record, _ in items]
+        max_workers = None if len(records) >= self.parallel_batch else 1
+        try:
+            result = await self._call(lambda: self.manager.create_invoices_bulk(records, max_workers=max_workers, pdf=pdf,
+                                                                                executor=self._render_pool))
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker process died; start a new pool for the next batches
+                self._render_pool.shutdown(wait=False)
+                self._render_pool = self._start_render_pool()
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        errors = {index: error for index, _, error in result.failed}
+        for index, (_, future) in enumerate(items):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                invoice_number, file_path = result.invoices[index]
+                future.set_result({'invoice_number': invoice_number, 'file_path': file_path})
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload = await self._dispatch(method, target.split('?')[0], body)
+                data = json.dumps(payload, default=str).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if version == 'HTTP/1.0' or headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        parts = [part for part in path.split('/') if part]
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            return 400, {'error': "Request body is not valid JSON."}
+
+        try:
+            if method == 'GET' and parts == ['health']:
+                return 200, {'status': 'ok'}
+            if method == 'GET' and parts == ['report']:
+                return 200, await self._call(self.manager.get_report)
+            if method == 'GET' and len(parts) == 2 and parts[0] == 'report':
+                rollup = await self._call(self.manager.get_rollup, parts[1])
+                return 200, rollup.reset_index().to_dict('records')
+            if method == 'GET' and parts == ['metrics']:
+                return 200, self.manager.get_metrics()
+            if method == 'POST' and parts == ['invoices']:
+                if not isinstance(data, dict):
+                    return 400, {'error': "Expected a JSON object with the invoice fields."}
+                return 201, await self.create(data)
+            if method == 'POST' and parts == ['invoices', 'bulk']:
+                if not isinstance(data, list) or not all(isinstance(record, dict) for record in data):
+                    return 400, {'error': "Expected a JSON list of invoices."}
+                result = await self._call(lambda: self.manager.create_invoices_bulk(data, executor=self._render_pool))
+                return 200, {'created': [{'index': index, 'invoice_number': number, 'file_path': path}
+                                         for index, (number, path) in sorted(result.invoices.items())],
+                             'failed': [{'index': index, 'error': str(error)} for index, _, error in result.failed]}
+            if method == 'GET' and len(parts) == 2 and parts[0] == 'invoices':
+                invoice = await self._call(self.manager.ledger.get, parts[1])
+                if invoice is None:
+                    return 404, {'error': f"Invoice {parts[1]} not found."}
+                return 200, invoice.astype(object).where(invoice.notna(), None).to_dict('records')[0]
+            if method == 'POST' and len(parts) == 3 and parts[0] == 'invoices' and parts[2] == 'paid':
+                if not await self._call(self.manager.update_invoice_status, parts[1], 'Paid'):
+                    return 404, {'error': f"Invoice {parts[1]} not found."}
+                return 200, {'invoice_number': parts[1], 'status': 'Paid'}
+        except (TypeError, ValueError, KeyError) as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': str(e)}
+        return 404, {'error': f"No route for {method} {path}."}
+
+
+class BackgroundWorker:
+    # Runs slow manager calls (rendering and saving invoices) on a worker thread so the Tk
+    # event loop never blocks. Jobs run one at a time in the order they were submitted. Their
+    # results are handed back through a queue that the Tk thread polls with root.after, so
+    # the callbacks can safely touch widgets.
+    def __init__(self, root, poll_interval=50):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='invoice-worker')
+        self._results = queue.Queue()
+        self._poll_job = None
+
+    def submit(self, function, *args, on_success=None, on_error=None, **kwargs):
+        self.pending += 1
+        future = self._executor.submit(function, *args, **kwargs)
+        future.add_done_callback(lambda done: self._results.put((done, on_success, on_error)))
+        if self._poll_job is None:
+            self._poll_job = self.root.after(self.poll_interval, self._poll)
+        return future
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                future, on_success, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            error = future.exception()
+            if error is None and on_success is not None:
+                on_success(future.result())
+            elif error is not None and on_error is not None:
+                on_error(error)
+        if self.pending:
+            self._poll_job = self.root.after(self.poll_interval, self._poll)
+
+    def shutdown(self):
+        # Wait for queued jobs so no invoice is lost when the window is closed
+        self._executor.shutdown(wait=True)
+
+
+class VirtualInvoiceList:
+    # A Treeview that only holds one page of invoices at a time, with buttons to move between
+    # pages. Creating an invoice adds a single item and changing a status updates a single
+    # cell, so the list is never rebuilt as a whole.
+    COLUMNS = ('Invoice Number', 'Name', 'Amount', 'Date', 'Due Date', 'Status')
+
+    def __init__(self, parent, manager, page_size=50):
+        self.manager = manager
+        self.page_size = page_size
+        self.page = 0
+        self._results = None  # search results being shown, or None for all invoices
+        self._total = 0
+
+        self.frame = ttk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=self.COLUMNS, show='headings')
+        for column in self.COLUMNS:
+            self.tree.heading(column, text=column)
+        scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.frame.columnconfigure(0, weight=1)
+
+        pager = ttk.Frame(self.frame)
+        pager.grid(row=1, column=0, columnspan=2, sticky=tk.E)
+        ttk.Button(pager, text="<< First", command=lambda: self.show_page(0)).grid(row=0, column=0, padx=2)
+        ttk.Button(pager, text="< Previous", command=lambda: self.show_page(self.page - 1)).grid(row=0, column=1, padx=2)
+        self.page_label = ttk.Label(pager, text="")
+        self.page_label.grid(row=0, column=2, padx=10)
+        ttk.Button(pager, text="Next >", command=lambda: self.show_page(self.page + 1)).grid(row=0, column=3, padx=2)
+        ttk.Button(pager, text="Last >>", command=lambda: self.show_page(self.page_count() - 1)).grid(row=0, column=4, padx=2)
+
+    def page_count(self):
+        return max(1, -(-self._total // self.page_size))
+
+    def _rows(self, start, stop):
+        if self._results is not None:
+            return self._results.iloc[start:stop]
+        return self.manager.get_invoices(start, stop)
+
+    def _insert(self, rows):
+        for values in rows[list(self.COLUMNS)].itertuples(index=False, name=None):
+            self.tree.insert('', 'end', values=values)
+
+    def _update_label(self):
+        first = self.page * self.page_size
+        last = min(first + self.page_size, self._total)
+        shown = f"{first + 1:,}-{last:,}" if self._total else "0"
+        kind = "matching invoices" if self._results is not None else "invoices"
+        self.page_label.configure(text=f"{shown} of {self._total:,} {kind}")
+
+    def show_page(self, page):
+        self.page = min(max(page, 0), self.page_count() - 1)
+        self.tree.delete(*self.tree.get_children())
+        start = self.page * self.page_size
+        self._insert(self._rows(start, start + self.page_size))
+        self._update_label()
+
+    def show_all(self):
+        # Show all invoices, starting at the page with the most recent ones
+        self._results = None
+        self._total = self.manager.count_invoices()
+        self.show_page(self.page_count() - 1)
+
+    def show_results(self, results):
+        self._results = results
+        self._total = len(results)
+        self.show_page(0)
+
+    def invoices_added(self):
+        # Add newly created invoices to the current page if they belong on it
+        if self._results is not None:
+            return
+        previous_total = self._total
+        self._total = self.manager.count_invoices()
+        page_end = (self.page + 1) * self.page_size
+        if previous_total < page_end:
+            self._insert(self._rows(previous_total, min(self._total, page_end)))
+        self._update_label()
+
+    def set_status(self, item, status):
+        self.tree.set(item, 'Status', status)
+        if self._results is not None:
+            # Keep the search results in sync for when the page is shown again
+            position = self.page * self.page_size + self.tree.index(item)
+            self._results.iloc[position, self._results.columns.get_loc('Status')] = status
+
+
+class InvoiceApp:
+    def __init__(self, root, manager):
+        self.manager = manager
+        self.root = root
+        self.root.title("Invoice Manager")
+        self.root.geometry("1600x1000")
+        self._search_job = None
+        self.worker = BackgroundWorker(root)
+        self.dashboard = None  # canvas items, created on the first update_visualization
+        self._dashboard_pending = False
+
+        self.create_widgets()
+
+    def create_widgets(self):
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        ttk.Label(main_frame, text="Name Recipient:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
+        self.name_entry = ttk.Entry(main_frame)
+        self.name_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Address:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        self.address_entry = ttk.Entry(main_frame)
+        self.address_entry.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="City:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+        self.city_entry = ttk.Entry(main_frame)
+        self.city_entry.grid(row=2, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Postal Code:").grid(row=3, column=0, sticky=tk.W, padx=5, pady=5)
+        self.postal_code_entry = ttk.Entry(main_frame)
+        self.postal_code_entry.grid(row=3, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Country:").grid(row=4, column=0, sticky=tk.W, padx=5, pady=5)
+        self.country_entry = ttk.Entry(main_frame)
+        self.country_entry.grid(row=4, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Phone Number:").grid(row=5, column=0, sticky=tk.W, padx=5, pady=5)
+        self.phone_number_entry = ttk.Entry(main_frame)
+        self.phone_number_entry.grid(row=5, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Amount:").grid(row=6, column=0, sticky=tk.W, padx=5, pady=5)
+        self.amount_entry = ttk.Entry(main_frame)
+        self.amount_entry.grid(row=6, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Hourly Rate:").grid(row=7, column=0, sticky=tk.W, padx=5, pady=5)
+        self.hourly_rate_entry = ttk.Entry(main_frame)
+        self.hourly_rate_entry.grid(row=7, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Hours Booked:").grid(row=8, column=0, sticky=tk.W, padx=5, pady=5)
+        self.hours_entry = ttk.Entry(main_frame)
+        self.hours_entry.grid(row=8, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Date (YYYY-MM-DD):").grid(row=9, column=0, sticky=tk.W, padx=5, pady=5)
+        self.date_entry = ttk.Entry(main_frame)
+        self.date_entry.grid(row=9, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Description:").grid(row=10, column=0, sticky=tk.W, padx=5, pady=5)
+        self.description_entry = ttk.Entry(main_frame)
+        self.description_entry.grid(row=10, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+
+        ttk.Button(main_frame, text="Create Invoice", command=self.create_invoice).grid(row=11, column=0, columnspan=2, padx=5, pady=5)
+        self.pdf_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_frame, text="Also save as PDF", variable=self.pdf_var).grid(row=11, column=2, sticky=tk.W, padx=5, pady=5)
+
+        self.invoice_view = VirtualInvoiceList(main_frame, self.manager)
+        self.invoice_view.frame.grid(row=12, column=0, columnspan=2, padx=5, pady=5, sticky=(tk.W, tk.E))
+        self.invoice_list = self.invoice_view.tree
+
+        ttk.Button(main_frame, text="Mark as Paid", command=self.mark_as_paid).grid(row=13, column=0, columnspan=2, padx=5, pady=5)
+
+        ttk.Label(main_frame, text="Search:").grid(row=14, column=0, sticky=tk.W, padx=5, pady=5)
+        self.search_entry = ttk.Entry(main_frame)
+        self.search_entry.grid(row=14, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
+        ttk.Button(main_frame, text="Search", command=self.search_invoices).grid(row=14, column=2, padx=5, pady=5)
+        self.search_entry.bind("<KeyRelease>", self.schedule_search)
+
+        self.detail_frame = ttk.Frame(main_frame, padding="10")
+        self.detail_frame.grid(row=15, column=0, columnspan=2, padx=5, pady=5, sticky=(tk.W, tk.E))
+
+        ttk.Label(self.detail_frame, text="Invoice Details", font=("Arial", 12, "bold")).grid(row=0, column=0, columnspan=2, pady=5)
+        self.invoice_detail_text = tk.Text(self.detail_frame, height=10, width=60)
+        self.invoice_detail_text.grid(row=1, column=0, columnspan=2, padx=5, pady=5)
+
+        self.invoice_list.bind("<Double-1>", self.show_invoice_details)
+
+        status_frame = ttk.Frame(main_frame)
+        status_frame.grid(row=16, column=0, columnspan=3, padx=5, pady=5, sticky=(tk.W, tk.E))
+        self.progress = ttk.Progressbar(status_frame, mode='indeterminate', length=150)
+        self.progress.grid(row=0, column=0, padx=5)
+        self.status_label = ttk.Label(status_frame, text="Ready")
+        self.status_label.grid(row=0, column=1, sticky=tk.W, padx=5)
+
+        self.update_invoice_list()
+        self.update_visualization()
+
+    def create_invoice(self):
+        name = self.name_entry.get()
+        address = self.address_entry.get()
+        city = self.city_entry.get()
+        postal_code = self.postal_code_entry.get()
+        country = self.country_entry.get()
+        phone_number = self.phone_number_entry.get()
+        amount = float(self.amount_entry.get()) if self.amount_entry.get() else None
+        hourly_rate = float(self.hourly_rate_entry.get()) if self.hourly_rate_entry.get() else None
+        hours = float(self.hours_entry.get()) if self.hours_entry.get() else None
+        date_str = self.date_entry.get()
+        description = self.description_entry.get()
+
+        if not date_str:
+            messagebox.showerror("Error", "Date field cannot be empty.")
+            return
+
+        try:
+            date = datetime.strptime(date_str, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("Error", "Date format is incorrect. Please use YYYY-MM-DD.")
+            return
+
+        due_date = date + timedelta(days=14)  # Due date is 14 days from the invoice date
+
+        # Render and save in the background; the form can be filled in again right away
+        self.worker.submit(self.manager.create_invoice, name, amount, date, due_date, hours, hourly_rate, amount, address, city,
+                           postal_code, country, phone_number, description, pdf=self.pdf_var.get(),
+                           on_success=self.invoice_created,
+                           on_error=lambda e, name=name: self.job_failed(f"Failed to create invoice for {name}: {e}"))
+        self.clear_entries()
+        self.update_status(f"Creating invoice for {name}...")
+
+    def invoice_created(self, invoice_path):
+        self.invoice_view.invoices_added()
+        self.update_status(f"Invoice successfully created at: {invoice_path}")
+        self.update_visualization()
+
+    def job_failed(self, message):
+        self.update_status(message, error=True)
+
+    def update_status(self, message, error=False):
+        if self.worker.pending:
+            self.progress.start(10)
+            message = f"{message} ({self.worker.pending} job{'s' if self.worker.pending != 1 else ''} in progress)"
+        else:
+            self.progress.stop()
+        self.status_label.configure(text=message, foreground='red' if error else '')
+
+    def clear_entries(self):
+        self.name_entry.delete(0, tk.END)
+        self.address_entry.delete(0, tk.END)
+        self.city_entry.delete(0, tk.END)
+        self.postal_code_entry.delete(0, tk.END)
+        self.country_entry.delete(0, tk.END)
+        self.phone_number_entry.delete(0, tk.END)
+        self.amount_entry.delete(0, tk.END)
+        self.hourly_rate_entry.delete(0, tk.END)
+        self.hours_entry.delete(0, tk.END)
+        self.date_entry.delete(0, tk.END)
+        self.description_entry.delete(0, tk.END)
+
+    def mark_as_paid(self):
+        selected_item = self.invoice_list.selection()
+        if not selected_item:
+            return
+        invoice_number = self.invoice_list.item(selected_item)['values'][0]
+        self.worker.submit(self.manager.update_invoice_status, invoice_number, 'Paid',
+                           on_success=lambda updated: self.invoice_paid(selected_item[0], invoice_number, updated),
+                           on_error=lambda e: self.job_failed(f"Failed to mark invoice {invoice_number} as paid: {e}"))
+        self.update_status(f"Marking invoice {invoice_number} as paid...")
+
+    def invoice_paid(self, item, invoice_number, updated):
+        if not updated:
+            # Not in the ledger (any more), so the row stays as it is
+            self.job_failed(f"Failed to mark invoice {invoice_number} as paid: invoice not found.")
+            return
+        # The page may have changed while the update was running
+        if self.invoice_list.exists(item):
+            self.invoice_view.set_status(item, 'Paid')
+        self.update_status(f"Invoice {invoice_number} marked as paid.")
+        self.update_visualization()
+
+    def close(self):
+        self.update_status("Finishing pending work...")
+        self.root.update_idletasks()
+        self.worker.shutdown()
+        self.manager.close()
+        self.root.destroy()
+
+    def update_invoice_list(self):
+        self.invoice_view.show_all()
+
+    def schedule_search(self, event=None):
+        # Search as you type, once typing pauses briefly
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(150, self.search_invoices)
+
+    def search_invoices(self):
+        self._search_job = None
+        query = self.search_entry.get().strip()
+        if not query:
+            self.update_invoice_list()  # Reset to show all invoices if search query is empty
+            return
+
+        try:
+            filtered_invoices = self.manager.search_invoices(query)
+            self.invoice_view.show_results(filtered_invoices)
+        except Exception as e:
+            messagebox.showerror("Search Error", f"Error occurred during search: {e}")
+
+
+
+    def show_invoice_details(self, event):
+        # Get the selected item in the invoice list
+        selected_item = self.invoice_list.selection()
+        
+        # Check if an item is selected
+        if not selected_item:
+            return
+        
+        try:
+            # Retrieve the invoice number from the selected item
+            invoice_number = self.invoice_list.item(selected_item)['values'][0]
+            
+            # Fetch detailed information about the invoice using the invoice number
+            invoice_details = self.manager.get_invoice_details(invoice_number)
+            
+            # Clear the current text in the invoice_detail_text widget
+            self.invoice_detail_text.delete('1.0', tk.END)
+            
+            # Insert the fetched invoice details into the text widget
+            self.invoice_detail_text.insert(tk.END, invoice_details)
+        
+        except Exception as e:
+            # Display an error message if fetching details fails
+            messagebox.showerror("Error", f"Failed to fetch invoice details: {e}")
+
+
+
+    def update_visualization(self):
+        # Fetch the dashboard figures in the background; they come from the ledger's rollups,
+        # so this is cheap after the first time. Updates requested while one is running are
+        # covered by it.
+        if self._dashboard_pending:
+            return
+        self._dashboard_pending = True
+        self.worker.submit(self.manager.get_dashboard, on_success=self.draw_dashboard,
+                           on_error=self.dashboard_failed)
+
+    def dashboard_failed(self, error):
+        self._dashboard_pending = False
+        self.job_failed(f"Failed to update the dashboard: {error}")
+
+    def draw_dashboard(self, dashboard):
+        self._dashboard_pending = False
+        if self.dashboard is None:
+            self.create_dashboard()
+        canvas, items = self.dashboard
+
+        canvas.itemconfigure(items['received'], text=f"Total Received: € {dashboard['total_received']:,.2f}")
+        canvas.itemconfigure(items['outstanding'], text=f"Total Outstanding: € {dashboard['total_outstanding']:,.2f}")
+        canvas.itemconfigure(items['hours'], text=f"Hours Billed: {dashboard['hours_billed']:,.1f}")
+        for (bucket, values), item in zip(dashboard['aging'].items(), items['aging']):
+            canvas.itemconfigure(item, text=f"{bucket} days: {values['count']} invoices, € {values['amount']:,.2f}")
+
+        # Invoiced (light) and received (dark) per month, scaled to the biggest month shown
+        months = dashboard['months']
+        highest = max(months['invoiced'].max() if len(months) else 0, 1)
+        for slot, (invoiced_bar, received_bar, label) in enumerate(items['months']):
+            if slot >= len(months):
+                for item in (invoiced_bar, received_bar, label):
+                    canvas.itemconfigure(item, state='hidden')
+                continue
+            month, invoiced, received = months.index[slot], months['invoiced'].iloc[slot], months['received'].iloc[slot]
+            left = 340 + slot * 45
+            canvas.coords(invoiced_bar, left, 330 - 270 * invoiced / highest, left + 30, 330)
+            canvas.coords(received_bar, left, 330 - 270 * received / highest, left + 30, 330)
+            canvas.itemconfigure(label, text=month[2:])
+            for item in (invoiced_bar, received_bar, label):
+                canvas.itemconfigure(item, state='normal')
+
+        customers = dashboard['customers']
+        for slot, item in enumerate(items['customers']):
+            text = ''
+            if slot < len(customers):
+                text = f"{customers.index[slot]}: € {customers['invoiced'].iloc[slot]:,.2f}"
+            canvas.itemconfigure(item, text=text)
+
+    def create_dashboard(self):
+        # The canvas and its items are created once; draw_dashboard only changes them
+        canvas = tk.Canvas(self.root, width=1200, height=400)
+        canvas.grid(row=1, column=0)
+        text = dict(anchor=tk.W, font=("Arial", 14))
+        items = {
+            'received': canvas.create_text(20, 40, **text),
+            'outstanding': canvas.create_text(20, 75, **text),
+            'hours': canvas.create_text(20, 110, **text),
+            'aging': [canvas.create_text(20, 185 + 28 * slot, anchor=tk.W, font=("Arial", 11))
+                      for slot in range(len(AGING_BUCKETS))],
+            'months': [(canvas.create_rectangle(0, 0, 0, 0, fill='#c6dbef', outline=''),
+                        canvas.create_rectangle(0, 0, 0, 0, fill='#2171b5', outline=''),
+                        canvas.create_text(355 + slot * 45, 345, font=("Arial", 9)))
+                       for slot in range(12)],
+            'customers': [canvas.create_text(900, 75 + 28 * slot, anchor=tk.W, font=("Arial", 11)) for slot in range(5)],
+        }
+        canvas.create_text(20, 155, text="Overdue", anchor=tk.W, font=("Arial", 12, "bold"))
+        canvas.create_text(340, 20, text="Invoiced and received per month", anchor=tk.W, font=("Arial", 12, "bold"))
+        canvas.create_text(900, 40, text="Top customers", anchor=tk.W, font=("Arial", 12, "bold"))
+        self.dashboard = (canvas, items)
+
+
+
+def _default_paths():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    template_path = os.path.join(current_dir, 'template.xlsx')
+    # Use the SQLite ledger once the CSV ledger has been migrated
+    booking_file = os.path.join(current_dir, 'invoice_booking.db')
+    if not os.path.exists(booking_file):
+        booking_file = os.path.join(current_dir, 'invoice_booking.csv')
+    return template_path, booking_file
+
+
+def _read_records(path):
+    # Invoices to import from a CSV file (one column per create_invoice argument) or a JSON list
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    # Read every column as text so postal codes and phone numbers keep their leading zeros,
+    # and only convert the number arguments. Empty cells become None; a value that isn't a
+    # number is passed on as is, so only that record fails.
+    records = pd.read_csv(path, dtype=str, keep_default_na=False).to_dict('records')
+    for record in records:
+        for key, value in record.items():
+            if value == '':
+                record[key] = None
+            elif key in ('amount', 'hours', 'hourly_rate', 'total'):
+                try:
+                    record[key] = float(value)
+                except ValueError:
+                    pass
+    return records
+
+
+def _date_argument(value):
+    # argparse type for YYYY-MM-DD options; the value stays a string
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {value!r}, expected YYYY-MM-DD")
+    return value
+
+
+def build_parser():
+    template_path, booking_file = _default_paths()
+    parser = argparse.ArgumentParser(description="Create and manage invoices. Without a command the GUI is started.")
+    parser.add_argument('--template', default=template_path, help="invoice template (default: %(default)s)")
+    parser.add_argument('--ledger', default=booking_file,
+                        help="booking ledger, a .csv file or an SQLite .db file (default: %(default)s)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every step and stage timing")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only log warnings and errors, and don't time stages")
+    parser.add_argument('--metrics', action='store_true', help="print stage timings and counters when done")
+    parser.add_argument('--profile', metavar='PATH', help="run the command under cProfile and save the stats to PATH")
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('gui', help="start the GUI (default)")
+
+    create = commands.add_parser('create', help="create one invoice")
+    create.add_argument('--name', required=True)
+    create.add_argument('--date', type=_date_argument, default=datetime.today().strftime("%Y-%m-%d"), help="invoice date, YYYY-MM-DD")
+    create.add_argument('--amount', type=float)
+    create.add_argument('--hours', type=float)
+    create.add_argument('--hourly-rate', type=float)
+    create.add_argument('--total', type=float)
+    create.add_argument('--address')
+    create.add_argument('--city')
+    create.add_argument('--postal-code')
+    create.add_argument('--country')
+    create.add_argument('--phone-number')
+    create.add_argument('--description')
+    create.add_argument('--pdf', action='store_true', help="also save the invoice as PDF")
+
+    bulk = commands.add_parser('bulk-import', help="create invoices from a CSV or JSON file")
+    bulk.add_argument('file', help="CSV with create_invoice argument names as columns, or a JSON list of objects")
+    bulk.add_argument('--workers', type=int, help="number of render processes (default: one per CPU)")
+    bulk.add_argument('--pdf', action='store_true', help="also save the invoices as PDF")
+
+    paid = commands.add_parser('mark-paid', help="mark invoices as paid")
+    paid.add_argument('invoice_numbers', nargs='+', metavar='invoice_number')
+
+    report = commands.add_parser('report', help="print totals, aging and reminders")
+    report.add_argument('--today', type=_date_argument, help="report date, YYYY-MM-DD (default: today)")
+    report.add_argument('--json', action='store_true', help="print the report as JSON")
+    report.add_argument('--reminders', action='store_true', help="also print reminders for overdue and due invoices")
+    report.add_argument('--by', choices=LedgerAggregates.DIMENSIONS,
+                        help="print invoices, amounts and hours per customer, month, ISO week or status instead")
+
+    export = commands.add_parser('export', help="write the ledger to a CSV file")
+    export.add_argument('path')
+
+    archive = commands.add_parser('archive', help="move old paid invoices out of the booking CSV into yearly archives")
+    archive.add_argument('--before', type=_date_argument, help="archive invoices dated before this date, YYYY-MM-DD "
+                                          "(default: January 1st of last year)")
+
+    migrate = commands.add_parser('migrate', help="copy a CSV ledger into an SQLite database")
+    migrate.add_argument('csv_file')
+    migrate.add_argument('database_file')
+
+    serve = commands.add_parser('serve', help="run the local HTTP service")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    return parser
+
+
+def run_gui(template_path, booking_file):
+    root = tk.Tk()
+    manager = InvoiceManager(template_path, booking_file)
+    app = InvoiceApp(root, manager)
+    root.protocol("WM_DELETE_WINDOW", app.close)
+    root.mainloop()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO,
+                        format='%(message)s')
+    if args.quiet and not args.metrics:
+        metrics.disable()
+
+    with metrics.profile(args.profile) if args.profile else contextlib.nullcontext():
+        status = run_command(args)
+    if args.metrics:
+        print(json.dumps(metrics.snapshot(), indent=2))
+    return status
+
+
+def run_command(args):
+    if args.command in (None, 'gui'):
+        run_gui(args.template, args.ledger)
+        return 0
+
+    if args.command == 'migrate':
+        count = migrate_csv_to_sqlite(args.csv_file, args.database_file)
+        print(f"Copied {count} invoices from {args.csv_file} to {args.database_file}.")
+        return 0
+
+    manager = InvoiceManager(args.template, args.ledger)
+    try:
+        if args.command == 'create':
+            invoice_path = manager.create_invoice(args.name, args.amount, args.date, hours=args.hours,
+                                                  hourly_rate=args.hourly_rate, total=args.total, address=args.address,
+                                                  city=args.city, postal_code=args.postal_code, country=args.country,
+                                                  phone_number=args.phone_number, description=args.description,
+                                                  pdf=args.pdf)
+            print(f"Saved invoice to {invoice_path}.")
+        elif args.command == 'bulk-import':
+            result = manager.create_invoices_bulk(_read_records(args.file), max_workers=args.workers, pdf=args.pdf)
+            print(f"Created {len(result.created)} of {result.total} invoices.")
+            for index, record, error in result.failed:
+                print(f"Record {index} failed: {error}")
+            return 1 if result.failed else 0
+        elif args.command == 'mark-paid':
+            missing = [number for number in args.invoice_numbers if not manager.update_invoice_status(number, 'Paid')]
+            for number in missing:
+                print(f"Invoice {number} not found.")
+            return 1 if missing else 0
+        elif args.command == 'report' and args.by:
+            rollup = manager.get_rollup(args.by)
+            if args.json:
+                print(json.dumps(rollup.reset_index().to_dict('records'), indent=2))
+            else:
+                print(rollup.to_string(float_format='{:,.2f}'.format))
+        elif args.command == 'report':
+            report = manager.get_report(args.today)
+            if args.json:
+                print(json.dumps(report, indent=2))
+            else:
+                print(f"Invoices:          {report['invoices']}")
+                print(f"Total received:    {report['total_received']:,.2f}")
+                print(f"Total outstanding: {report['total_outstanding']:,.2f}")
+                for bucket, values in report['aging'].items():
+                    print(f"Overdue {bucket + ' days:':12} {values['count']} invoices, {values['amount']:,.2f}")
+            if args.reminders:
+                for reminder in manager.iter_reminders(args.today):
+                    print(reminder)
+        elif args.command == 'export':
+            manager.export_csv(args.path)
+        elif args.command == 'archive':
+            count = manager.archive(args.before)
+            print(f"Archived {count} invoices; {manager.count_invoices()} invoices in total.")
+        elif args.command == 'serve':
+            try:
+                asyncio.run(InvoiceService(manager).serve(args.host, args.port))
+            except KeyboardInterrupt:
+                pass
+        return 0
+    finally:
+        manager.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,365 @@
+import argparse
+import csv
+import filecmp
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from InvoiceManager import (LEDGER_COLUMNS, BookingLedger, InvoiceManager, _day_number, get_invoice_template, metrics,
+                            read_ledger_csv, render_invoice_pdf, render_invoice_workbook,
+                            render_invoice_workbook_openpyxl, write_ledger_csv)
+
+
+SAMPLE_CELLS = {
+    'B22': 'Consultancy', 'F12': 's1', 'C22': '2024-01-01', 'B9': '2024-01-01', 'D22': '1', 'E22': 8,
+    'F22': '€ 95.00', 'B12': 'Example Customer', 'B13': 'Keizersgracht 1', 'B14': 'Amsterdam',
+    'B15': '1015 CJ, Netherlands', 'B16': '+31 20 123 4567', 'F17': '2024-01-15',
+}
+
+# Synthetic ledgers end on this date, so the same seed always gives the same ledger and the
+# same reminders, whenever the benchmark runs
+LEDGER_END = datetime(2024, 12, 31)
+
+FIRST_NAMES = ['Anna', 'Bram', 'Chloé', 'Daan', 'Emma', 'Finn', 'Greta', 'Hugo', 'Inès', 'Jan', 'Julia', 'Lars',
+               'Lotte', 'Mila', 'Noah', 'Olivia', 'Pieter', 'Rosa', 'Sem', 'Søren', 'Tess', 'Yara', 'Zoë', 'Jürgen']
+LAST_NAMES = ['de Jong', 'Jansen', 'de Vries', 'van den Berg', 'Bakker', 'Visser', 'Smit', 'Meijer', 'Mulder',
+              'Bos', 'Vos', 'Peters', 'Hendriks', 'Dekker', 'Brouwer', 'Müller', 'Schmidt', 'Dubois', 'García']
+COMPANY_SUFFIXES = ['', '', '', ' B.V.', ' Consultancy', ' & Partners', ' Holding']
+CITIES = [('Amsterdam', '1015 CJ'), ('Rotterdam', '3011 AD'), ('Utrecht', '3511 LX'), ('Den Haag', '2511 BT'),
+          ('Eindhoven', '5611 AZ'), ('Groningen', '9711 LM'), ('Köln', '50667'), ('Antwerpen', '2000'),
+          ('Liège', '4000'), ('Zürich', '8001')]
+COUNTRIES = {'Köln': 'Germany', 'Antwerpen': 'Belgium', 'Liège': 'Belgium', 'Zürich': 'Switzerland'}
+STREETS = ['Kerkstraat', 'Dorpsstraat', 'Hoofdweg', 'Stationsplein']
+DESCRIPTIONS = ['Consultancy', 'Software development', 'Workshop', 'Maintenance', 'Data analysis', 'Training']
+HOURLY_RATES = [65, 75, 85, 95, 110, 125]
+
+
+def time_calls(function, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return (time.perf_counter() - start) / count
+
+
+def time_once(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def synthetic_rows(rows, seed=0):
+    # Booking rows (in LEDGER_COLUMNS order) like the ones create_invoice writes, spread over
+    # the years before LEDGER_END. Older invoices are mostly paid, recent ones mostly
+    # outstanding.
+    rng = random.Random(seed)
+    span = max(rows // 40, 365)  # about forty invoices a day, and at least a year of history
+    dates = {}
+    for number in range(1, rows + 1):
+        age = span * (rows - number) // rows
+        if age not in dates:
+            date = LEDGER_END - timedelta(days=age)
+            dates[age] = (date.strftime("%Y-%m-%d"), (date + timedelta(days=14)).strftime("%Y-%m-%d"))
+        date, due_date = dates[age]
+
+        city, postal_code = rng.choice(CITIES)
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{rng.choice(COMPANY_SUFFIXES)}"
+        hours = rng.randint(1, 80)
+        hourly_rate = rng.choice(HOURLY_RATES)
+        paid = rng.random() < (0.97 if age > 90 else 0.6 if age > 14 else 0.1)
+        yield (f's{number}', name, hours * hourly_rate, date, due_date, f'invoice_s{number}_{name}.xlsx',
+               f"{rng.choice(STREETS)} {rng.randint(1, 250)}", city, postal_code, COUNTRIES.get(city, 'Netherlands'),
+               f"+31 6 {rng.randint(10000000, 99999999)}", hourly_rate, hours, 'Paid' if paid else 'Outstanding',
+               rng.choice(DESCRIPTIONS))
+
+
+def generate_ledger(path, rows, seed=0):
+    # Write a synthetic booking CSV; the same rows and seed always give the same file
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')  # like the CSV pandas writes
+        writer.writerow(LEDGER_COLUMNS)
+        writer.writerows(synthetic_rows(rows, seed))
+
+
+def invoice_records(count, seed=1):
+    # Arguments for create_invoice / create_invoices_bulk
+    rng = random.Random(seed)
+    records = []
+    for _ in range(count):
+        city, postal_code = rng.choice(CITIES)
+        records.append({
+            'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'amount': None,
+            'date': LEDGER_END.strftime("%Y-%m-%d"),
+            'hours': rng.randint(1, 80),
+            'hourly_rate': rng.choice(HOURLY_RATES),
+            'address': f"{rng.choice(STREETS)} {rng.randint(1, 250)}",
+            'city': city,
+            'postal_code': postal_code,
+            'country': COUNTRIES.get(city, 'Netherlands'),
+            'description': rng.choice(DESCRIPTIONS),
+        })
+    return records
+
+
+def bench_render(template_path, count):
+    # Compare rendering one invoice through openpyxl with patching the cached template
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_path = os.path.join(output_dir, 'invoice.xlsx')
+
+        openpyxl_time = time_calls(lambda: render_invoice_workbook_openpyxl(template_path, output_path, SAMPLE_CELLS), count)
+        parse_time = time_once(lambda: get_invoice_template(template_path))
+        patch_time = time_calls(lambda: render_invoice_workbook(template_path, output_path, SAMPLE_CELLS), count)
+
+    return {'render/openpyxl': openpyxl_time, 'render/template_parse': parse_time, 'render/patch': patch_time}
+
+
+def bench_pdf(template_path, count):
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_path = os.path.join(output_dir, 'invoice.pdf')
+
+        first_time = time_once(lambda: render_invoice_pdf(template_path, output_path, SAMPLE_CELLS))
+        pdf_time = time_calls(lambda: render_invoice_pdf(template_path, output_path, SAMPLE_CELLS), count)
+
+    return {'pdf/first_with_layout': first_time, 'pdf/per_invoice': pdf_time}
+
+
+STARTUP_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import InvoiceManager
+imported = time.perf_counter()
+manager = InvoiceManager.InvoiceManager(sys.argv[1], sys.argv[2])
+manager.next_invoice_number
+constructed = time.perf_counter()
+manager.count_invoices()
+print(imported - start, constructed - imported, time.perf_counter() - constructed)
+'''
+
+
+def time_startup(template_path, booking_file):
+    # Import, construct the manager (including the next invoice number) and load the
+    # ledger in a fresh interpreter, like a script or the command line would
+    output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, template_path, booking_file],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    return tuple(map(float, output.stdout.split()[-3:]))
+
+
+def bench_metrics(count):
+    # What timing one stage costs, with metrics enabled and disabled (silent mode)
+    def stages():
+        for _ in range(1000):
+            with metrics.stage('benchmark'):
+                pass
+
+    enabled_time = time_calls(stages, count) / 1000
+    metrics.disable()
+    try:
+        disabled_time = time_calls(stages, count) / 1000
+    finally:
+        metrics.enable()
+        metrics.reset()
+    return {'metrics/stage_enabled': enabled_time, 'metrics/stage_disabled': disabled_time}
+
+
+def bench_memory(booking_file, label):
+    # Memory of the ledger read as plain pandas text columns and as the typed ledger, and
+    # the time to read and write the typed ledger. Writing it back must give the same file.
+    plain = pd.read_csv(booking_file)
+    typed = [None]
+    read_time = time_once(lambda: typed.__setitem__(0, read_ledger_csv(booking_file)))
+    typed = typed[0]
+
+    copy = booking_file + '.roundtrip'
+    write_time = time_once(lambda: write_ledger_csv(typed, copy))
+    try:
+        if not filecmp.cmp(booking_file, copy, shallow=False):
+            raise RuntimeError(f"Writing the typed ledger of {booking_file} back doesn't give the same CSV.")
+    finally:
+        os.remove(copy)
+
+    return {f'{label}/memory_plain_mb': plain.memory_usage(deep=True).sum() / 1e6,
+            f'{label}/memory_typed_mb': typed.memory_usage(deep=True).sum() / 1e6,
+            f'{label}/typed_read': read_time, f'{label}/typed_write': write_time}
+
+
+def bench_startup(template_path, booking_file, label):
+    # The first start has no saved invoice number and has to read the ledger for it
+    import_time, cold_time, _ = time_startup(template_path, booking_file)
+    _, warm_time, load_time = time_startup(template_path, booking_file)
+    return {'startup/import': import_time, f'{label}/startup_cold': cold_time, f'{label}/startup_warm': warm_time,
+            f'{label}/ledger_load': load_time}
+
+
+def bench_ledger(template_path, booking_file, label, count):
+    # The manager operations behind the GUI and the command line, on one ledger
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        manager = InvoiceManager(template_path, booking_file, output_dir=output_dir)
+        try:
+            rows = manager.count_invoices()
+            today = LEDGER_END + timedelta(days=1)
+
+            results[f'{label}/list_page'] = time_calls(lambda: manager.get_invoices(max(0, rows - 50), rows), count)
+            results[f'{label}/totals'] = time_calls(
+                lambda: (manager.get_total_received(), manager.get_total_outstanding()), count)
+
+            queries = ['jan', 'müller', 'amster', 'consult', 's12']
+            results[f'{label}/search_first'] = time_once(lambda: manager.search_invoices('zoe'))
+            results[f'{label}/search'] = time_calls(lambda: [manager.search_invoices(query) for query in queries],
+                                                    count) / len(queries)
+            results[f'{label}/search_as_you_type'] = time_calls(
+                lambda: [manager.search_invoices('consultancy'[:length]) for length in range(1, 12)], count) / 11
+
+            results[f'{label}/reminders_first'] = time_once(lambda: manager.send_reminders(today))
+            results[f'{label}/reminders'] = time_calls(lambda: manager.send_reminders(today), count)
+            results[f'{label}/aging'] = time_calls(lambda: manager.get_aging_report(today), count)
+            results[f'{label}/dashboard_first'] = time_once(lambda: manager.get_dashboard(today))
+
+            records = invoice_records(count * 2)
+            results[f'{label}/create_single'] = time_calls(lambda: manager.create_invoice(**records.pop()), count)
+            metrics.disable()
+            try:
+                results[f'{label}/create_single_silent'] = time_calls(
+                    lambda: manager.create_invoice(**records.pop()), count)
+            finally:
+                metrics.enable()
+            bulk_records = invoice_records(count * 10)
+            results[f'{label}/create_bulk_per_invoice'] = time_once(
+                lambda: manager.create_invoices_bulk(bulk_records)) / len(bulk_records)
+
+            numbers = iter(range(1, rows + 1))
+            results[f'{label}/status_update'] = time_calls(
+                lambda: manager.update_invoice_status(f's{next(numbers)}', 'Paid'), count)
+
+            # The rollups were kept up to date through the creates and updates above
+            results[f'{label}/dashboard'] = time_calls(lambda: manager.get_dashboard(today), count)
+        finally:
+            manager.close()
+    return results
+
+
+def bench_archive(template_path, booking_file, label):
+    # Archiving the paid invoices of the years before the last one, and startup and memory
+    # with only the rest in the CSV. The first lookup and search in the archive read it.
+    ledger = BookingLedger(booking_file)
+    try:
+        archive_time = time_once(lambda: ledger.archive(_day_number(LEDGER_END.replace(month=1, day=1))))
+    finally:
+        ledger.close()
+    _, _, load_time = time_startup(template_path, booking_file)
+
+    ledger = BookingLedger(booking_file)
+    try:
+        len(ledger)
+        lookup_time = time_once(lambda: ledger.get('s1'))
+        search_time = time_once(lambda: ledger.search('zoe'))
+    finally:
+        ledger.close()
+    return {f'{label}/archive': archive_time, f'{label}/ledger_load_archived': load_time,
+            f'{label}/memory_hot_mb': read_ledger_csv(booking_file).memory_usage(deep=True).sum() / 1e6,
+            f'{label}/archived_lookup_first': lookup_time, f'{label}/archived_search_first': search_time}
+
+
+def run_suite(template_path, sizes, count, seed):
+    results = {}
+    results.update(bench_render(template_path, count))
+    results.update(bench_pdf(template_path, count))
+    results.update(bench_metrics(count))
+
+    with tempfile.TemporaryDirectory() as ledger_dir:
+        for rows in sizes:
+            label = f'ledger_{rows}'
+            generated = os.path.join(ledger_dir, f'generated_{rows}.csv')
+            results[f'{label}/generate'] = time_once(lambda: generate_ledger(generated, rows, seed))
+            results.update(bench_memory(generated, label))
+
+            # Every run starts from a fresh copy, without journal, saved invoice number or archive
+            for benchmark in (bench_startup, bench_ledger, bench_archive):
+                booking_file = os.path.join(ledger_dir, f'invoice_booking_{rows}.csv')
+                for suffix in ('', '.journal', '.seq', '.lock'):
+                    if os.path.exists(booking_file + suffix):
+                        os.remove(booking_file + suffix)
+                shutil.rmtree(booking_file + '.archive', ignore_errors=True)
+                shutil.copyfile(generated, booking_file)
+                if benchmark is bench_ledger:
+                    results.update(bench_ledger(template_path, booking_file, label, count))
+                else:
+                    results.update(benchmark(template_path, booking_file, label))
+    return results
+
+
+def format_result(name, value):
+    # Results are seconds, except for the memory sizes in MB
+    if name.endswith('_mb'):
+        return f"{value:10.1f} MB"
+    return f"{value * 1000:10.3f} ms"
+
+
+def compare(results, baseline, tolerance):
+    # Print every result next to its baseline and return the names that got slower (or
+    # bigger) by more than the tolerance
+    regressions = []
+    for name, value in results.items():
+        before = baseline.get(name)
+        if before is None or before <= 0:
+            print(f"{name:45} {format_result(name, value)}")
+            continue
+        change = value / before - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:45} {format_result(name, value)}  (baseline {format_result(name, before)}, {change:+7.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Invoice Manager benchmarks")
+    parser.add_argument('--template', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template.xlsx'))
+    parser.add_argument('--count', type=int, default=20, help="repetitions per measurement")
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="comma-separated ledger sizes to generate (default: %(default)s; up to 1000000)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic ledgers")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown against the baseline before a timing counts as a regression")
+    parser.add_argument('--generate', metavar='PATH', help="only write a synthetic ledger of the first size to PATH")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    if args.generate:
+        generate_ledger(args.generate, sizes[0], args.seed)
+        return 0
+
+    results = run_suite(args.template, sizes, args.count, args.seed)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                       'sizes': sizes, 'count': args.count, 'seed': args.seed, 'results': results,
+                       'metrics': metrics.snapshot()}, f, indent=2)
+
+    if regressions:
+        print(f"{len(regressions)} results are more than {args.tolerance:.0%} worse than the baseline.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
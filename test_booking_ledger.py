@@ -0,0 +1,198 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from InvoiceManager import (BookingLedger, LedgerAggregates, SqliteBookingStorage, _day_number, read_ledger_csv,
+                            write_ledger_csv)
+
+# A booking CSV as the original pandas code wrote it: hours as floats once any invoice had
+# fractional hours, and a rate column with both '0' and '50.5'
+BASELINE_CSV = (
+    'Invoice Number,Name,Amount,Date,Due Date,File Path,Address,City,Postal Code,Country,Phone Number,'
+    'Hourly Rate,Hours Booked,Status,Description\n'
+    's1,Acme,101,2024-03-01,2024-03-15,invoices/invoice_s1_Acme.xlsx,Main Street 1,Utrecht,3511,NL,,'
+    '50.5,2.0,Paid,Consulting\n'
+    's2,Globex,80,2024-03-04,2024-03-18,invoices/invoice_s2_Globex.xlsx,,,,,,0,3.0,Outstanding,\n'
+    's3,Initech,1250,2024-03-05,2024-03-19,invoices/invoice_s3_Initech.xlsx,Hoofdweg 7,Köln,0101,Germany,'
+    '+49 221 123,125,10.0,Outstanding,"Workshop, two days"\n'
+)
+
+
+def booking_row(number, name, date, status='Outstanding', amount=100):
+    # A booking row the way InvoiceManager writes it, due 14 days after the invoice date
+    due_date = datetime.strptime(date, "%Y-%m-%d") + timedelta(days=14)
+    return {'Invoice Number': f's{number}', 'Name': name, 'Description': 'Consulting', 'Amount': amount,
+            'Date': date, 'Due Date': due_date.strftime("%Y-%m-%d"), 'File Path': f'invoice_s{number}.xlsx',
+            'Address': 'Main Street 1', 'City': 'Utrecht', 'Postal Code': '3511', 'Country': 'NL',
+            'Phone Number': '0301234567', 'Hourly Rate': 0, 'Hours Booked': 0, 'Status': status}
+
+
+class SharedLedgerTest(unittest.TestCase):
+    # Two BookingLedger instances on one CSV behave like two processes sharing the ledger:
+    # each one has to pick up what the other wrote, including compactions that replace the
+    # snapshot and move rows to the archive.
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.booking_file = os.path.join(self.directory, 'invoice_booking.csv')
+        self.ledgers = []
+        self.today = datetime.today()
+
+    def tearDown(self):
+        for ledger in self.ledgers:
+            ledger.close()
+        shutil.rmtree(self.directory)
+
+    def open_ledger(self, hot_years=1):
+        ledger = BookingLedger(self.booking_file, fsync=False, hot_years=hot_years)
+        self.ledgers.append(ledger)
+        return ledger
+
+    def days_ago(self, days):
+        return (self.today - timedelta(days=days)).strftime("%Y-%m-%d")
+
+    def numbers(self, df):
+        return sorted(df['Invoice Number'].tolist(), key=lambda number: int(number[1:]))
+
+    def test_search_after_other_compacts(self):
+        first, second = self.open_ledger(), self.open_ledger()
+        first.append_invoices([booking_row(1, 'Acme', self.days_ago(5))])
+        self.assertEqual(self.numbers(first.search('acme')), ['s1'])
+
+        second.append_invoices([booking_row(2, 'Globex', self.days_ago(5))])
+        second.compact()
+        self.assertEqual(self.numbers(first.search('globex')), ['s2'])
+        self.assertEqual(self.numbers(first.search('acme')), ['s1'])
+
+    def test_aging_after_other_compacts(self):
+        first, second = self.open_ledger(), self.open_ledger()
+        today_day = _day_number(self.today)
+        first.append_invoices([booking_row(1, 'Acme', self.days_ago(20))])
+        self.assertEqual(first.aging(today_day)['1-30']['count'], 1)
+
+        second.append_invoices([booking_row(2, 'Globex', self.days_ago(25), amount=250)])
+        second.compact()
+        self.assertEqual(first.aging(today_day)['1-30'], {'count': 2, 'amount': 350.0})
+        self.assertEqual(self.numbers(first.due_between(None, today_day)), ['s1', 's2'])
+
+    def test_due_today_is_not_overdue(self):
+        ledger = self.open_ledger()
+        today_day = _day_number(self.today)
+        ledger.append_invoices([booking_row(1, 'Acme', self.days_ago(14)), booking_row(2, 'Acme', self.days_ago(15))])
+        self.assertEqual(self.numbers(ledger.due_between(None, today_day)), ['s2'])
+        self.assertEqual(ledger.aging(today_day)['1-30'], {'count': 1, 'amount': 100.0})
+
+    def test_due_chunks_across_archiving_compaction(self):
+        # Old paid invoices ahead of the outstanding ones are archived by the other ledger
+        # while the first is between chunks, which shifts every row position
+        first, second = self.open_ledger(hot_years=None), self.open_ledger()
+        old = (self.today - timedelta(days=800)).strftime("%Y-%m-%d")
+        first.append_invoices([booking_row(number, 'Acme', old, status='Paid') for number in range(1, 11)])
+        first.append_invoices([booking_row(number, 'Globex', self.days_ago(number)) for number in range(11, 15)])
+        first.compact()
+        second.update_status('s12', 'Paid')
+
+        chunks = first.iter_due_between(chunk_size=1)
+        seen = next(chunks)['Invoice Number'].tolist()
+        second.compact()
+        self.assertEqual(len(first), 14)  # reloads
+        self.assertEqual(len(first._archive), 10)
+        for chunk in chunks:
+            seen += chunk['Invoice Number'].tolist()
+        self.assertEqual(sorted(seen), ['s11', 's13', 's14'])
+
+    def test_interleaved_writes_stay_consistent(self):
+        first, second = self.open_ledger(), self.open_ledger()
+        today_day = _day_number(self.today)
+        for number in range(1, 21):
+            ledger = first if number % 2 else second
+            ledger.append_invoices([booking_row(number, f'Customer {number % 3}', self.days_ago(number))])
+            if number % 5 == 0:
+                ledger.update_status(f's{number - 1}', 'Paid')
+                (second if number % 2 else first).compact()
+            first.search('customer')
+            first.aging(today_day)
+
+        for ledger in (first, second):
+            self.assertEqual(len(ledger), 20)
+            self.assertEqual(len(ledger.search('customer')), 20)
+            self.assertEqual(ledger.total('Paid'), 400.0)
+            self.assertEqual(len(ledger.due_between()), 16)
+            self.assertEqual(ledger.check_consistency(), [])
+
+    def test_rollups_without_reading_the_archive(self):
+        first = self.open_ledger()
+        old = (self.today - timedelta(days=800)).strftime("%Y-%m-%d")
+        first.append_invoices([booking_row(number, 'Acme', old, status='Paid', amount=number) for number in range(1, 6)])
+        first.append_invoices([booking_row(6, 'Globex', self.days_ago(3))])
+        self.assertEqual(first.archive(), 5)
+
+        second = self.open_ledger()
+        rollup = second.rollup('customer')
+        self.assertEqual(second._archive._frames, {})
+        self.assertEqual(rollup.loc['Acme', 'received'], 15.0)
+        self.assertEqual(rollup.loc['Globex', 'outstanding'], 100.0)
+
+        first.update_status('s2', 'Outstanding')  # goes back from the archive to the CSV
+        self.assertEqual(second.rollup('status').loc['Outstanding', 'invoiced'], 102.0)
+        self.assertEqual(self.open_ledger().rollup('status').loc['Paid', 'invoiced'], 13.0)
+        for ledger in (first, second):
+            self.assertEqual(ledger.check_consistency(), [])
+
+
+class SqliteRollupTest(unittest.TestCase):
+    def test_rollups_match_the_ledger(self):
+        directory = tempfile.mkdtemp()
+        storage = SqliteBookingStorage(os.path.join(directory, 'invoices.db'), fsync=False)
+        try:
+            storage.append_invoices([booking_row(1, 'Acme', '2020-12-31', status='Paid'),
+                                     booking_row(2, 'Acme', '2021-01-01', amount=40),
+                                     booking_row(3, 'Globex', '2021-01-04', amount=250)])
+            rollup = storage.rollup('week')
+            self.assertEqual(rollup.index.tolist(), ['2020-W53', '2021-W01'])
+            self.assertEqual(LedgerAggregates(storage.df).differences(storage._aggregates), [])
+
+            other = SqliteBookingStorage(os.path.join(directory, 'invoices.db'), fsync=False)
+            other.update_status('s2', 'Paid')
+            other.close()
+            self.assertEqual(storage.rollup('status').loc['Paid', 'received'], 140.0)
+            self.assertEqual(storage.check_consistency(), [])
+        finally:
+            storage.close()
+            shutil.rmtree(directory)
+
+
+class LedgerCsvTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.booking_file = os.path.join(self.directory, 'invoice_booking.csv')
+        with open(self.booking_file, 'w', encoding='utf-8', newline='') as f:
+            f.write(BASELINE_CSV)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_baseline_csv_round_trip(self):
+        df = read_ledger_csv(self.booking_file)
+        self.assertEqual(df['Amount'].dtype, 'float64')
+        copy = os.path.join(self.directory, 'copy.csv')
+        write_ledger_csv(df, copy)
+        self.assertEqual(self.read(copy), self.read(self.booking_file))
+
+    def test_compaction_keeps_baseline_csv(self):
+        ledger = BookingLedger(self.booking_file, fsync=False, hot_years=None)
+        try:
+            self.assertEqual(len(ledger), 3)
+            ledger.compact()
+        finally:
+            ledger.close()
+        self.assertEqual(self.read(self.booking_file), BASELINE_CSV.encode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()